@@ -0,0 +1,234 @@
+'''
+Benchmark warstwy bazy danych dla typowego obciążenia służb.
+
+Tworzy tymczasową bazę z syntetycznymi danymi (serwery x użytkownicy x logi),
+a następnie z wielu współbieżnych zadań wywołuje mieszankę operacji z `database.aio`.
+Wynik (przepustowość oraz opóźnienia p50/p95/p99 dla każdej operacji) jest wypisywany
+jako JSON, żeby można było porównywać kolejne zmiany.
+
+Przykład:
+    python benchmark_db.py --guilds 10 --users 200 --logs 2000 --tasks 32 --ops 20000
+    python benchmark_db.py --shards --output bench.json
+    python benchmark_db.py --shards --guilds 40   # więcej shardów niż database.SHARD_MAX_OPEN
+    python benchmark_db.py --mix write-heavy      # same zapisy, partie logu bez przeplatanych odczytów
+'''
+import argparse
+import asyncio
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+import database
+
+# Domyślna mieszanka operacji (wagi względne)
+DEFAULT_MIX = {
+    'add_user_to_duty': 20,
+    'adjust_user_total_duty_seconds': 20,
+    'log_duty_event': 30,
+    'get_all_total_duty_seconds': 15,
+    'get_duty_logs': 15,
+}
+
+# Gotowe mieszanki dla --mix. "write-heavy" nie zawiera odczytów logów (które wymuszają
+# zapis bufora), więc bufor logu służby wielokrotnie zapełnia się do batch_size.
+PRESETS = {
+    'default': DEFAULT_MIX,
+    'write-heavy': {
+        'log_duty_event': 70,
+        'adjust_user_total_duty_seconds': 20,
+        'add_user_to_duty': 10,
+    },
+}
+
+# Dodatkowy czas dla wątku nadzorczego, gdy pętla zdarzeń nie może obsłużyć wait_for
+WATCHDOG_GRACE_SECONDS = 10
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark bazy danych bota (obciążenie służb).")
+    parser.add_argument("--guilds", type=int, default=10, help="liczba serwerów")
+    parser.add_argument("--users", type=int, default=200, help="liczba użytkowników na serwer")
+    parser.add_argument("--logs", type=int, default=2000, help="liczba wpisów logu na serwer")
+    parser.add_argument("--tasks", type=int, default=32, help="liczba współbieżnych zadań")
+    parser.add_argument("--ops", type=int, default=20000, help="łączna liczba operacji")
+    parser.add_argument("--mix", type=str, default=None,
+                        help="nazwa mieszanki (" + ", ".join(PRESETS) + ") albo wagi operacji, np. 'add_user_to_duty=1,get_duty_logs=3'")
+    parser.add_argument("--shards", action="store_true", help="użyj osobnej bazy dla każdego serwera")
+    parser.add_argument("--timeout", type=float, default=300.0, help="limit czasu obciążenia (s); przekroczenie kończy się błędem")
+    parser.add_argument("--seed", type=int, default=1234, help="ziarno generatora losowego")
+    parser.add_argument("--output", type=str, default=None, help="plik JSON z wynikami (domyślnie stdout)")
+    return parser.parse_args()
+
+def parse_mix(value):
+    if not value:
+        return dict(DEFAULT_MIX)
+    if value in PRESETS:
+        return dict(PRESETS[value])
+    mix = {}
+    for part in value.split(","):
+        name, weight = part.split("=")
+        if name not in DEFAULT_MIX:
+            raise SystemExit(f"Nieznana operacja w --mix: {name}")
+        mix[name] = float(weight)
+    return mix
+
+def seed_data(args, rng):
+    """Wypełnia bazę danymi startowymi bezpośrednio przez SQL (szybciej niż przez API)."""
+    now = datetime.datetime.utcnow()
+    for guild_id in range(1, args.guilds + 1):
+        conn = database.get_db_connection(guild_id)
+        with conn:
+            conn.execute(
+                "INSERT INTO duty_panels (guild_id, channel_id, active_message_id, summary_message_id, log_channel_id) VALUES (?, 1, 2, 3, 4)",
+                (guild_id,)
+            )
+            conn.executemany(
+                "INSERT INTO user_duty_stats (user_id, guild_id, total_duty_seconds) VALUES (?, ?, ?)",
+                [(user_id, guild_id, rng.randint(0, 500 * 3600)) for user_id in range(1, args.users + 1)]
+            )
+            logs = []
+            for _ in range(args.logs):
+                timestamp = now - datetime.timedelta(seconds=rng.randint(0, 90 * 86400))
+                logs.append((timestamp.isoformat(), int(timestamp.replace(tzinfo=datetime.timezone.utc).timestamp()),
+                             guild_id, rng.randint(1, args.users), "Wszedł na służbę", None))
+            conn.executemany(
+                "INSERT INTO duty_logs (timestamp, ts_epoch, guild_id, user_id, action, details) VALUES (?, ?, ?, ?, ?, ?)",
+                logs
+            )
+
+def make_operation(name, args, rng):
+    guild_id = rng.randint(1, args.guilds)
+    user_id = rng.randint(1, args.users)
+    if name == 'add_user_to_duty':
+        return database.aio.add_user_to_duty(user_id, guild_id, datetime.datetime.utcnow(), None)
+    if name == 'adjust_user_total_duty_seconds':
+        return database.aio.adjust_user_total_duty_seconds(user_id, guild_id, rng.randint(60, 4 * 3600))
+    if name == 'log_duty_event':
+        return database.aio.log_duty_event(guild_id, user_id, "Benchmark", None)
+    if name == 'get_all_total_duty_seconds':
+        return database.aio.get_all_total_duty_seconds(guild_id)
+    if name == 'get_duty_logs':
+        return database.aio.get_duty_logs(guild_id, 100)
+    raise ValueError(name)
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def summarize(latencies, elapsed):
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "throughput_ops_s": round(len(values) / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(values, 0.50) * 1000, 3) if values else None,
+        "p95_ms": round(percentile(values, 0.95) * 1000, 3) if values else None,
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3) if values else None,
+        "max_ms": round(values[-1] * 1000, 3) if values else None,
+    }
+
+async def run_workload(args, mix):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    latencies = {name: [] for name in names}
+    remaining = args.ops
+
+    async def worker(worker_id):
+        nonlocal remaining
+        rng = random.Random(args.seed * 1000 + worker_id)
+        while remaining > 0:
+            remaining -= 1
+            name = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            await make_operation(name, args, rng)
+            latencies[name].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(args.tasks)))
+    # Zbuforowane logi też są częścią pracy - wliczamy ich zapis do czasu całkowitego
+    await database.aio.flush_duty_logs()
+    elapsed = time.perf_counter() - started
+    return latencies, elapsed
+
+def main():
+    args = parse_args()
+    mix = parse_mix(args.mix)
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix="bot-db-bench-")
+    try:
+        database.configure(
+            db_path=os.path.join(workdir, "database.db"),
+            shard_dir=os.path.join(workdir, "shards") if args.shards else None
+        )
+        # Komunikaty migracji (także nowych shardów) na stderr, żeby stdout zawierał tylko wynik JSON
+        with contextlib.redirect_stdout(sys.stderr):
+            database.initialize_db()
+            seed_started = time.perf_counter()
+            seed_data(args, rng)
+            seed_elapsed = time.perf_counter() - seed_started
+        database.warm_duty_cache()
+        # Przegląd wszystkich baz (przy shardach także ponad limit otwartych połączeń) musi się zgadzać z pamięcią podręczną
+        problems = database.verify_duty_cache()
+        if problems:
+            raise SystemExit("Pamięć podręczna niezgodna z bazą:\n" + "\n".join(problems))
+
+        def abort():
+            print(f"Obciążenie nie zakończyło się w {args.timeout:.0f}s - prawdopodobne zakleszczenie warstwy bazy.", file=sys.stderr)
+            shutil.rmtree(workdir, ignore_errors=True)
+            # Wątki bazy (albo sama pętla zdarzeń) mogą być zablokowane, więc shutdown() też by zawisł
+            os._exit(1)
+
+        # wait_for nie pomoże, gdy zablokowana jest sama pętla zdarzeń (np. wywołanie z _memory_api),
+        # więc zapasowo pilnuje tego osobny wątek
+        watchdog = threading.Timer(args.timeout + WATCHDOG_GRACE_SECONDS, abort)
+        watchdog.daemon = True
+        watchdog.start()
+        try:
+            latencies, elapsed = asyncio.run(asyncio.wait_for(run_workload(args, mix), args.timeout))
+        except asyncio.TimeoutError:
+            abort()
+        finally:
+            watchdog.cancel()
+        all_latencies = [value for values in latencies.values() for value in values]
+        result = {
+            "config": {
+                "guilds": args.guilds,
+                "users_per_guild": args.users,
+                "logs_per_guild": args.logs,
+                "tasks": args.tasks,
+                "ops": args.ops,
+                "mix": mix,
+                "shards": args.shards,
+                "seed": args.seed,
+            },
+            "environment": {
+                "python": platform.python_version(),
+                "sqlite": sqlite3.sqlite_version,
+                "platform": platform.platform(),
+            },
+            "seed_seconds": round(seed_elapsed, 3),
+            "elapsed_seconds": round(elapsed, 3),
+            "total": summarize(all_latencies, elapsed),
+            "operations": {name: summarize(values, elapsed) for name, values in latencies.items()},
+            "audit_log": database.audit_log.stats(),
+        }
+        output = json.dumps(result, indent=2, ensure_ascii=False)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                f.write(output + "\n")
+        print(output)
+    finally:
+        database.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,12 @@
 import discord
 from discord import app_commands
 from discord.ext import commands
+import asyncio
+import logging
+import time
+import database
+
+logger = logging.getLogger('bot')
 
 # Stałe role
 VIEWER_ROLE_ID = 1396940699798081621  # dostęp tylko, bez pisania
@@ -11,6 +17,12 @@ TICKET_CHANNEL_ID = 1396940700611907621  # ID kanału z formularzem
 TICKET_CATEGORY_ID = 1396940700788199545  # ID kategorii dla ticketów
 ARCHIVE_CATEGORY_ID = 1396940707503013926 # ID kategorii dla archiwum
 
+# Kolejka tworzenia ticketów
+MAX_OPEN_TICKETS_PER_USER = 2  # otwarte + oczekujące w kolejce
+TICKET_CREATE_INTERVAL = 2.0  # minimalny odstęp (s) między tworzeniem kanałów
+TICKET_QUEUE_MAX = 100  # powyżej tylu oczekujących nowe zgłoszenia są odrzucane
+TICKET_CREATE_MAX_ATTEMPTS = 3
+
 # Konfiguracja typów ticketów
 TICKET_TYPES = {
 	"ranga": {
@@ -92,36 +104,208 @@ TICKET_TYPES = {
 	}
 }
 
+class TicketCreationQueue:
+	"""
+	Kolejka tworzenia kanałów zgłoszeń: jeden pracownik tworzy kanały po kolei, nie częściej
+	niż co `interval` sekund, a limit zgłoszeń osoby uwzględnia także te czekające w kolejce.
+	"""
+
+	def __init__(self, interval=TICKET_CREATE_INTERVAL, max_size=TICKET_QUEUE_MAX, per_user=MAX_OPEN_TICKETS_PER_USER):
+		self.interval = interval
+		self.per_user = per_user
+		self._queue = asyncio.Queue(maxsize=max_size)
+		self._pending = {}  # (serwer, użytkownik) -> liczba zgłoszeń w kolejce
+		self._worker = None
+		self.created = 0
+		self.rejected = 0
+		self.failed = 0
+		self.total_wait = 0.0
+		self.max_wait = 0.0
+
+	async def submit(self, interaction: discord.Interaction, topic_key, answers):
+		"""Przyjmuje zgłoszenie. Zwraca None albo komunikat z powodem odrzucenia."""
+		key = (interaction.guild.id, interaction.user.id)
+		# Rezerwujemy miejsce przed odczytem z bazy, żeby równoległe zgłoszenia tej osoby się widziały
+		self._pending[key] = self._pending.get(key, 0) + 1
+		try:
+			open_tickets = await database.aio.count_open_tickets(*key)
+		except Exception:
+			self._release(key)
+			raise
+		if open_tickets + self._pending[key] > self.per_user:
+			self._release(key)
+			self.rejected += 1
+			return f"Masz już {self.per_user} otwarte lub oczekujące zgłoszenia. Zamknij któreś, zanim otworzysz kolejne."
+		try:
+			self._queue.put_nowait((time.monotonic(), interaction, topic_key, answers))
+		except asyncio.QueueFull:
+			self._release(key)
+			self.rejected += 1
+			return "Zbyt wiele zgłoszeń naraz - spróbuj ponownie za chwilę."
+		if self._worker is None or self._worker.done():
+			self._worker = asyncio.create_task(self._run())
+		return None
+
+	async def _run(self):
+		while True:
+			queued_at, interaction, topic_key, answers = await self._queue.get()
+			key = (interaction.guild.id, interaction.user.id)
+			wait = time.monotonic() - queued_at
+			self.total_wait += wait
+			self.max_wait = max(self.max_wait, wait)
+			try:
+				channel = await self._create_with_retry(interaction, topic_key, answers)
+			except Exception:
+				self.failed += 1
+				logger.exception(f"Nie udało się utworzyć zgłoszenia dla {interaction.user.id}")
+				await self._notify(interaction, "Nie udało się utworzyć zgłoszenia. Spróbuj ponownie później.")
+			else:
+				self.created += 1
+				await self._notify(interaction, f"✅ Zgłoszenie utworzone: {channel.mention}")
+			finally:
+				self._release(key)
+				self._queue.task_done()
+			await asyncio.sleep(self.interval)
+
+	def _release(self, key):
+		self._pending[key] -= 1
+		if not self._pending[key]:
+			del self._pending[key]
+
+	async def _create_with_retry(self, interaction, topic_key, answers):
+		for attempt in range(1, TICKET_CREATE_MAX_ATTEMPTS + 1):
+			try:
+				return await create_ticket_channel(interaction, topic_key, answers)
+			except discord.HTTPException as e:
+				if e.status != 429 or attempt == TICKET_CREATE_MAX_ATTEMPTS:
+					raise
+				retry_after = float(e.response.headers.get("Retry-After", self.interval * 2 ** attempt))
+				logger.warning(f"Limit tworzenia kanałów - ponowienie za {retry_after:.0f}s.")
+				await asyncio.sleep(retry_after)
+
+	async def _notify(self, interaction, content):
+		try:
+			await interaction.followup.send(content, ephemeral=True)
+		except discord.HTTPException:
+			pass  # token interakcji mógł wygasnąć - kanał i tak powstał
+
+	def cancel(self):
+		if self._worker is not None:
+			self._worker.cancel()
+
+	def stats(self):
+		processed = self.created + self.failed
+		return {
+			"w kolejce": self._queue.qsize(),
+			"utworzone": self.created,
+			"odrzucone": self.rejected,
+			"błędy": self.failed,
+			"średnie oczekiwanie (s)": round(self.total_wait / processed, 2) if processed else 0,
+			"maks. oczekiwanie (s)": round(self.max_wait, 2),
+		}
+
 class TicketSystem(commands.Cog):
 	def __init__(self, bot):
 		self.bot = bot
+		self.creation_queue = TicketCreationQueue()
+		# Trwałe widoki rejestrowane raz przy ładowaniu coga (w setup_hook) - obsługują
+		# panel i przyciski wszystkich zgłoszeń, także sprzed restartu
+		self.bot.add_view(TicketDropdownView())
+		self.bot.add_view(TicketControlView())
+		self.panel_message_id = None
+		self.panel_checked = False
+
+	async def cog_unload(self):
+		self.creation_queue.cancel()
+
+	@app_commands.command(name="statystyki_zgloszen", description="Pokazuje stan kolejki tworzenia zgłoszeń.")
+	@app_commands.checks.has_permissions(administrator=True)
+	async def statystyki_zgloszen(self, interaction: discord.Interaction):
+		stats = self.creation_queue.stats()
+		embed = discord.Embed(title="Kolejka zgłoszeń", color=discord.Color.blurple())
+		embed.description = "\n".join(f"{key}: {value}" for key, value in stats.items())
+		await interaction.response.send_message(embed=embed, ephemeral=True)
 
 	@commands.Cog.listener()
 	async def on_ready(self):
+		# on_ready przychodzi też po każdym wznowieniu połączenia - panel sprawdzamy tylko raz
+		if self.panel_checked:
+			return
+		self.panel_checked = True
 		print("TicketSystem cog załadowany.")
 		await self.send_ticket_message()
 
 	async def send_ticket_message(self):
+		"""
+		Zapewnia panel zgłoszeń na kanale (raz na uruchomienie procesu). Zapisany panel jest
+		sprawdzany jednym zapytaniem; później jego usunięcie wykrywamy zdarzeniem usunięcia
+		wiadomości i wtedy wysyłamy nowy.
+		"""
 		channel = self.bot.get_channel(TICKET_CHANNEL_ID)
 		if channel is None:
 			return
-		existing = [msg async for msg in channel.history(limit=10)]
-		if any(msg.author == self.bot.user for msg in existing):
+		panel = await database.aio.get_ticket_panel(channel.guild.id)
+		if panel and panel['channel_id'] == channel.id:
+			try:
+				await channel.fetch_message(panel['message_id'])
+			except discord.NotFound:
+				# Panel usunięty, gdy bot był wyłączony
+				await self.post_panel(channel)
+				return
+			self.panel_message_id = panel['message_id']
 			return
 
-		view = TicketDropdownView()
+		if panel is None:
+			# Jednorazowe przejęcie panelu wysłanego przed zapisywaniem jego ID
+			async for message in channel.history(limit=10):
+				if message.author == self.bot.user:
+					await message.edit(view=TicketDropdownView())
+					await self.remember_panel(message)
+					return
+		await self.post_panel(channel)
+
+	async def post_panel(self, channel: discord.TextChannel):
 		embed = discord.Embed(
 			title="🎫 Otwórz zgłoszenie",
 			description="Wybierz temat, a następnie wypełnij formularz zgłoszenia.",
 			color=discord.Color.blurple()
 		)
-		await channel.send(embed=embed, view=view)
+		message = await channel.send(embed=embed, view=TicketDropdownView())
+		await self.remember_panel(message)
+
+	async def remember_panel(self, message: discord.Message):
+		self.panel_message_id = message.id
+		await database.aio.set_ticket_panel(message.guild.id, message.channel.id, message.id)
+
+	@commands.Cog.listener()
+	async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+		# Kanał zgłoszenia usunięty ręcznie - zamykamy je, żeby nie blokowało limitu twórcy.
+		# Inne kanały pomijamy (przy shardach zapytanie utworzyłoby plik bazy dla serwera bez zgłoszeń).
+		if channel.category_id not in (TICKET_CATEGORY_ID, ARCHIVE_CATEGORY_ID):
+			return
+		await database.aio.close_ticket(channel.guild.id, channel.id)
+
+	@commands.Cog.listener()
+	async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+		if payload.message_id == self.panel_message_id:
+			await self.repost_panel()
+
+	@commands.Cog.listener()
+	async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+		if self.panel_message_id in payload.message_ids:
+			await self.repost_panel()
+
+	async def repost_panel(self):
+		self.panel_message_id = None
+		channel = self.bot.get_channel(TICKET_CHANNEL_ID)
+		if channel is not None:
+			await self.post_panel(channel)
 
 class TicketDropdown(discord.ui.Select):
 	def __init__(self):
 		options = [discord.SelectOption(label=data["label"], value=key)
 				   for key, data in TICKET_TYPES.items()]
-		super().__init__(placeholder="Wybierz temat zgłoszenia...", min_values=1, max_values=1, options=options)
+		super().__init__(placeholder="Wybierz temat zgłoszenia...", min_values=1, max_values=1, options=options, custom_id="ticket_topic_select")
 
 	async def callback(self, interaction: discord.Interaction):
 		topic_key = self.values[0]
@@ -147,69 +331,103 @@ class TicketModal(discord.ui.Modal):
 			self.add_item(inp)
 
 	async def on_submit(self, interaction: discord.Interaction):
-		guild = interaction.guild
-		category = guild.get_channel(TICKET_CATEGORY_ID)
-		cfg = TICKET_TYPES[self.topic_key]
-
-		# Budowanie overwrite permissions
-		overwrites = {guild.default_role: discord.PermissionOverwrite(view_channel=False)}
-		# Zawsze dodaj role VIEWER_ROLE_ID (tylko czytanie) i WRITER_ROLE_ID
-		overwrites[guild.get_role(VIEWER_ROLE_ID)] = discord.PermissionOverwrite(view_channel=True, send_messages=False)
-		overwrites[guild.get_role(WRITER_ROLE_ID)] = discord.PermissionOverwrite(view_channel=True, send_messages=True)
-		# Role handler:
-		for role_id in cfg['handler_roles']:
-			overwrites[guild.get_role(role_id)] = discord.PermissionOverwrite(view_channel=True, send_messages=True)
-		# Role viewer:
-		for role_id in cfg['viewer_roles']:
-			overwrites[guild.get_role(role_id)] = discord.PermissionOverwrite(view_channel=True, send_messages=False)
-		# Użytkownik:
-		overwrites[interaction.user] = discord.PermissionOverwrite(view_channel=True, send_messages=True)
-
-		# Tworzenie kanału ticket
-		channel_name = f"ticket-{interaction.user.name}".replace(" ", "-").lower()
-		ticket_channel = await guild.create_text_channel(
-			name=channel_name,
-			category=category,
-			overwrites=overwrites,
-			topic=f"{cfg['label']} zgłoszenie od {interaction.user.name}"
-		)
+		# Potwierdzamy od razu - kanał tworzy kolejka, wynik przychodzi jako followup
+		await interaction.response.defer(ephemeral=True, thinking=True)
+		cog = interaction.client.get_cog("TicketSystem")
+		answers = [(inp.label, inp.value) for inp in self.inputs]
+		error = await cog.creation_queue.submit(interaction, self.topic_key, answers)
+		if error:
+			await interaction.followup.send(error, ephemeral=True)
 
-		# Przygotowanie embed i view kontrolnego
-		embed_desc = "\n".join(f"**{inp.label}:** {inp.value}" for inp in self.inputs)
-		view = TicketControlView(cfg['handler_roles'] + [WRITER_ROLE_ID])
-		embed = discord.Embed(
-			title="📩 Nowe zgłoszenie",
-			description=embed_desc,
-			color=discord.Color.green()
-		)
-		mentions = f"{interaction.user.mention} | " + " ".join(f"<@&{rid}>" for rid in cfg['handler_roles'])
-		await ticket_channel.send(content=mentions, embed=embed, view=view)
-		await interaction.response.send_message(f"✅ Zgłoszenie utworzone: {ticket_channel.mention}", ephemeral=True)
+async def create_ticket_channel(interaction: discord.Interaction, topic_key, answers):
+	"""Tworzy kanał zgłoszenia, zapisuje je w bazie i wysyła formularz z przyciskami."""
+	guild = interaction.guild
+	category = guild.get_channel(TICKET_CATEGORY_ID)
+	cfg = TICKET_TYPES[topic_key]
+
+	# Budowanie overwrite permissions
+	overwrites = {guild.default_role: discord.PermissionOverwrite(view_channel=False)}
+	# Zawsze dodaj role VIEWER_ROLE_ID (tylko czytanie) i WRITER_ROLE_ID
+	overwrites[guild.get_role(VIEWER_ROLE_ID)] = discord.PermissionOverwrite(view_channel=True, send_messages=False)
+	overwrites[guild.get_role(WRITER_ROLE_ID)] = discord.PermissionOverwrite(view_channel=True, send_messages=True)
+	# Role handler:
+	for role_id in cfg['handler_roles']:
+		overwrites[guild.get_role(role_id)] = discord.PermissionOverwrite(view_channel=True, send_messages=True)
+	# Role viewer:
+	for role_id in cfg['viewer_roles']:
+		overwrites[guild.get_role(role_id)] = discord.PermissionOverwrite(view_channel=True, send_messages=False)
+	# Użytkownik:
+	overwrites[interaction.user] = discord.PermissionOverwrite(view_channel=True, send_messages=True)
+
+	# Tworzenie kanału ticket
+	channel_name = f"ticket-{interaction.user.name}".replace(" ", "-").lower()
+	ticket_channel = await guild.create_text_channel(
+		name=channel_name,
+		category=category,
+		overwrites=overwrites,
+		topic=f"{cfg['label']} zgłoszenie od {interaction.user.name}"
+	)
+
+	await database.aio.create_ticket(guild.id, ticket_channel.id, interaction.user.id, topic_key)
+
+	# Przygotowanie embed i view kontrolnego
+	embed_desc = "\n".join(f"**{label}:** {value}" for label, value in answers)
+	view = TicketControlView()
+	embed = discord.Embed(
+		title="📩 Nowe zgłoszenie",
+		description=embed_desc,
+		color=discord.Color.green()
+	)
+	mentions = f"{interaction.user.mention} | " + " ".join(f"<@&{rid}>" for rid in cfg['handler_roles'])
+	await ticket_channel.send(content=mentions, embed=embed, view=view)
+	return ticket_channel
 
 class TicketControlView(discord.ui.View):
-	def __init__(self, allowed_roles):
+	"""
+	Trwały widok przycisków zgłoszenia. Stan (twórca, typ, przejmujący) jest w bazie
+	pod ID kanału, więc ten sam widok obsługuje każde zgłoszenie, także po restarcie.
+	"""
+
+	def __init__(self, claimed_by_name=None, closed=False):
 		super().__init__(timeout=None)
-		self.allowed_roles = allowed_roles
-		self.claimed_by = None
+		if claimed_by_name:
+			self.claim.disabled = True
+			self.claim.label = f"Przejęte przez {claimed_by_name}"
+		if closed:
+			for item in self.children:
+				item.disabled = True
 
-	@discord.ui.button(label="Przejmij zgłoszenie", style=discord.ButtonStyle.success)
-	async def claim(self, interaction: discord.Interaction, button: discord.ui.Button):
-		if not any(role.id in self.allowed_roles for role in interaction.user.roles):
+	async def load_ticket(self, interaction: discord.Interaction):
+		"""Zwraca wiersz zgłoszenia kanału, jeśli użytkownik ma uprawnienia; inaczej odpowiada i zwraca None."""
+		ticket = await database.aio.get_ticket(interaction.guild.id, interaction.channel.id)
+		if ticket is None:
+			await interaction.response.send_message("Nie znaleziono tego zgłoszenia w bazie.", ephemeral=True)
+			return None
+		cfg = TICKET_TYPES.get(ticket['ticket_type'], {"handler_roles": []})
+		allowed_roles = cfg['handler_roles'] + [WRITER_ROLE_ID]
+		if not any(role.id in allowed_roles for role in interaction.user.roles):
 			await interaction.response.send_message("Brak uprawnień.", ephemeral=True)
+			return None
+		return ticket
+
+	@discord.ui.button(label="Przejmij zgłoszenie", style=discord.ButtonStyle.success, custom_id="ticket_claim")
+	async def claim(self, interaction: discord.Interaction, button: discord.ui.Button):
+		if await self.load_ticket(interaction) is None:
+			return
+		ticket = await database.aio.claim_ticket(interaction.guild.id, interaction.channel.id, interaction.user.id)
+		if ticket['closed_at']:
+			await interaction.response.send_message("Zgłoszenie jest już zamknięte.", ephemeral=True)
 			return
-		if self.claimed_by:
-			await interaction.response.send_message(f"Już przejęte przez {self.claimed_by.mention}.", ephemeral=True)
+		if ticket['claimed_by'] != interaction.user.id:
+			await interaction.response.send_message(f"Już przejęte przez <@{ticket['claimed_by']}>.", ephemeral=True)
 			return
-		self.claimed_by = interaction.user
-		button.disabled = True
-		button.label = f"Przejęte przez {interaction.user.display_name}"
-		await interaction.response.edit_message(view=self)
+		await interaction.response.edit_message(view=TicketControlView(claimed_by_name=interaction.user.display_name))
 		await interaction.followup.send(f"Zgłoszenie przejął: {interaction.user.mention}", ephemeral=False)
 
-	@discord.ui.button(label="Zamknij zgłoszenie", style=discord.ButtonStyle.danger)
+	@discord.ui.button(label="Zamknij zgłoszenie", style=discord.ButtonStyle.danger, custom_id="ticket_close")
 	async def close(self, interaction: discord.Interaction, button: discord.ui.Button):
-		if not any(role.id in self.allowed_roles for role in interaction.user.roles):
-			await interaction.response.send_message("Brak uprawnień.", ephemeral=True)
+		ticket = await self.load_ticket(interaction)
+		if ticket is None:
 			return
 
 		archive_category = interaction.guild.get_channel(ARCHIVE_CATEGORY_ID)
@@ -217,28 +435,23 @@ class TicketControlView(discord.ui.View):
 			await interaction.response.send_message("Nie znaleziono kategorii archiwum.", ephemeral=True)
 			return
 
-		# Znajdź twórcę ticketu (autora pierwszej wiadomości)
-		ticket_creator = None
-		async for message in interaction.channel.history(oldest_first=True, limit=1):
-			if message.mentions:
-				ticket_creator = message.mentions[0]
-			break
-
-		# Nowe uprawnienia dla zarchiwizowanego kanału
+		# Nowe uprawnienia dla zarchiwizowanego kanału (twórca zgłoszenia traci dostęp)
 		overwrites = {
 			interaction.guild.default_role: discord.PermissionOverwrite(view_channel=False),
-			interaction.guild.get_role(WRITER_ROLE_ID): discord.PermissionOverwrite(view_channel=True, send_messages=True)
+			interaction.guild.get_role(WRITER_ROLE_ID): discord.PermissionOverwrite(view_channel=True, send_messages=True),
+			discord.Object(id=ticket['creator_id']): discord.PermissionOverwrite(view_channel=False)
 		}
-		if ticket_creator:
-			overwrites[ticket_creator] = discord.PermissionOverwrite(view_channel=False)
 
 		await interaction.channel.edit(category=archive_category, overwrites=overwrites)
+		await database.aio.close_ticket(interaction.guild.id, interaction.channel.id)
 		await interaction.response.send_message("Zgłoszenie zostało zarchiwizowane.", ephemeral=True)
 
-		# Wyłącz przyciski po archiwizacji
-		for item in self.children:
-			item.disabled = True
-		await interaction.message.edit(view=self)
+		# Wyłącz przyciski po archiwizacji (z zachowaniem informacji o przejęciu)
+		claimed_by_name = None
+		if ticket['claimed_by']:
+			names = await database.aio.get_user_names(interaction.guild.id, [ticket['claimed_by']])
+			claimed_by_name = names.get(ticket['claimed_by'], f"ID: {ticket['claimed_by']}")
+		await interaction.message.edit(view=TicketControlView(claimed_by_name=claimed_by_name, closed=True))
 
 async def setup(bot):
 	await bot.add_cog(TicketSystem(bot))
\ No newline at end of file
@@ -6,12 +6,45 @@ import database
 import logging
 import pytz
 import asyncio
+import os
+import tempfile
+import hashlib
+import json
+import re
+import collections
+import heapq
 
 logger = logging.getLogger('bot')
 
 # Zmienna dla roli uprawnionej do odwoływania ze służby
 ODWOLAJ_ROLE_ID = 1396940700112781448  # UZUPEŁNIJ ID ROLI
 
+# Minimalny odstęp (w sekundach) między kolejnymi odświeżeniami paneli jednego serwera
+PANEL_REFRESH_WINDOW = 5.0
+# Ile serwerów może jednocześnie odświeżać panele
+PANEL_REFRESH_CONCURRENCY = 4
+
+# Interwał pętli odświeżania (minuty) i część interwału, na którą rozkładamy serwery
+UPDATE_LOOP_MINUTES = 5
+UPDATE_LOOP_SPREAD = 0.8
+
+# Wycofanie po błędzie 429 dla danej trasy (sekundy): podwajane przy kolejnych 429
+RATE_LIMIT_BACKOFF_BASE = 5.0
+RATE_LIMIT_BACKOFF_MAX = 300.0
+
+# Kolejka zadań Discorda (logi służby): ile zadań naraz, ile prób i opóźnienie pierwszej ponowki
+DUTY_JOB_CONCURRENCY = 4
+DUTY_JOB_MAX_ATTEMPTS = 4
+DUTY_JOB_RETRY_DELAY = 2.0
+# Ile sekund przy wyładowaniu coga czekamy na dokończenie zaległych zadań
+DUTY_JOB_DRAIN_TIMEOUT = 10.0
+
+# Panel podsumowania: liczba pozycji rankingu na jednej stronie
+SUMMARY_PAGE_SIZE = 25
+
+# Ile ostatnio zapisanych nazw wyświetlanych trzymamy w pamięci (reszta jest tylko w bazie)
+KNOWN_NAMES_MAX = 10000
+
 async def handle_interaction_error(interaction: discord.Interaction):
     """Centralna funkcja do obsługi wygasłych interakcji."""
     try:
@@ -21,6 +54,258 @@ async def handle_interaction_error(interaction: discord.Interaction):
         logger.warning(f"Interaction {interaction.id} not found (likely expired). Command will not send a followup.")
         return False
 
+class PanelRefreshScheduler:
+    """
+    Łączy żądania odświeżenia paneli serwera: pierwsze żądanie jest obsługiwane od razu,
+    a kolejne w ciągu okna `window` tylko oznaczają panel jako nieaktualny - po upływie
+    okna wykonywane jest jedno odświeżenie zamiast wielu.
+    """
+
+    def __init__(self, refresh, window: float = PANEL_REFRESH_WINDOW, concurrency: int = PANEL_REFRESH_CONCURRENCY):
+        self._refresh = refresh
+        self.window = window
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._dirty = {}
+        self._tasks = {}
+        self._delayed = {}
+        self.requested = 0
+        self.performed = 0
+
+    def request(self, guild: discord.Guild):
+        self.requested += 1
+        self._dirty[guild.id] = guild
+        if guild.id not in self._tasks:
+            self._tasks[guild.id] = asyncio.create_task(self._run(guild.id))
+
+    async def _run(self, guild_id: int):
+        try:
+            while guild_id in self._dirty:
+                async with self._semaphore:
+                    guild = self._dirty.pop(guild_id)
+                    self.performed += 1
+                    try:
+                        await self._refresh(guild)
+                    except Exception:
+                        logger.exception(f"Błąd odświeżania paneli służby (serwer {guild_id})")
+                await asyncio.sleep(self.window)
+        finally:
+            self._tasks.pop(guild_id, None)
+
+    def request_after(self, guild: discord.Guild, delay: float):
+        """Zleca odświeżenie po `delay` sekundach (np. po wycofaniu z powodu limitu)."""
+        previous = self._delayed.pop(guild.id, None)
+        if previous is not None:
+            previous.cancel()
+        self._delayed[guild.id] = asyncio.get_running_loop().call_later(delay, self._request_delayed, guild)
+
+    def _request_delayed(self, guild: discord.Guild):
+        self._delayed.pop(guild.id, None)
+        self.request(guild)
+
+    def cancel(self):
+        for task in self._tasks.values():
+            task.cancel()
+        for handle in self._delayed.values():
+            handle.cancel()
+        self._tasks.clear()
+        self._delayed.clear()
+        self._dirty.clear()
+
+    def stats(self) -> dict:
+        return {"requested": self.requested, "performed": self.performed, "pending": len(self._dirty)}
+
+class DutyJobQueue:
+    """
+    Kolejka efektów ubocznych w Discordzie (wysyłka/edycja logów służby) wykonywanych poza
+    interakcją. Zadania jednego klucza (serwer, użytkownik) idą po kolei, różne klucze
+    równolegle (najwyżej `concurrency` naraz). Błędy HTTP są ponawiane z wydłużanym odstępem.
+    """
+
+    def __init__(self, concurrency: int = DUTY_JOB_CONCURRENCY, max_attempts: int = DUTY_JOB_MAX_ATTEMPTS, retry_delay: float = DUTY_JOB_RETRY_DELAY):
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._queues = {}
+        self._tasks = {}
+        self.queued = 0
+        self.done = 0
+        self.retried = 0
+        self.failed = 0
+
+    def submit(self, key, job, description: str = "zadanie"):
+        """Dodaje zadanie (funkcję zwracającą korutynę) na koniec kolejki klucza."""
+        self.queued += 1
+        self._queues.setdefault(key, collections.deque()).append((job, description))
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._run(key))
+
+    async def _run(self, key):
+        try:
+            queue = self._queues[key]
+            while queue:
+                job, description = queue[0]
+                await self._attempt(job, description)
+                queue.popleft()
+        finally:
+            self._queues.pop(key, None)
+            self._tasks.pop(key, None)
+
+    async def _attempt(self, job, description: str):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                # Miejsce zajmujemy tylko na czas wywołania - odstęp przed ponowieniem go nie blokuje
+                async with self._semaphore:
+                    await job()
+                self.done += 1
+                return
+            except (discord.Forbidden, discord.NotFound):
+                logger.warning(f"Pominięto {description}: brak uprawnień lub obiekt nie istnieje.")
+                break
+            except (discord.HTTPException, asyncio.TimeoutError) as e:
+                if attempt == self.max_attempts:
+                    logger.error(f"Nie udało się wykonać: {description} ({e}) - rezygnuję po {attempt} próbach.")
+                    break
+                self.retried += 1
+                await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+            except Exception:
+                logger.exception(f"Błąd zadania: {description}")
+                break
+        self.failed += 1
+
+    async def drain(self, timeout: float = DUTY_JOB_DRAIN_TIMEOUT):
+        """Czeka (najwyżej `timeout` s) na dokończenie zaległych zadań, potem je przerywa."""
+        tasks = list(self._tasks.values())
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+        for task in self._tasks.values():
+            task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queued, "done": self.done, "retried": self.retried, "failed": self.failed,
+            "pending": sum(len(queue) for queue in self._queues.values()),
+        }
+
+class ShiftDeadlineScheduler:
+    """
+    Kopiec terminów automatycznego zamknięcia służb. Jedno zadanie śpi do najbliższego
+    terminu (albo do dodania wcześniejszego) i przekazuje wszystkie wymagalne służby
+    do `on_expired(guild_id, [(user_id, start_time, deadline), ...])`, zgrupowane per serwer.
+    Wpisy służb zakończonych ręcznie zostają w kopcu i są ignorowane przy zamykaniu.
+    """
+
+    def __init__(self, on_expired):
+        self._on_expired = on_expired
+        self._heap = []
+        # Zmiana limitu serwera unieważnia jego wcześniejsze wpisy (leniwe usuwanie)
+        self._generations = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.scheduled = 0
+        self.fired = 0
+
+    def schedule(self, guild_id: int, user_id: int, start_time: datetime.datetime, deadline: datetime.datetime):
+        entry = (deadline, guild_id, user_id, start_time, self._generations.get(guild_id, 0))
+        heapq.heappush(self._heap, entry)
+        self.scheduled += 1
+        if self._heap[0] is entry:
+            self._wakeup.set()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def reset_guild(self, guild_id: int):
+        self._generations[guild_id] = self._generations.get(guild_id, 0) + 1
+
+    def _is_current(self, entry) -> bool:
+        return entry[4] == self._generations.get(entry[1], 0)
+
+    async def _run(self):
+        while True:
+            while self._heap and not self._is_current(self._heap[0]):
+                heapq.heappop(self._heap)
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+            delay = (self._heap[0][0] - datetime.datetime.utcnow()).total_seconds()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            now = datetime.datetime.utcnow()
+            due = {}
+            while self._heap and self._heap[0][0] <= now:
+                entry = heapq.heappop(self._heap)
+                if self._is_current(entry):
+                    deadline, guild_id, user_id, start_time, _ = entry
+                    due.setdefault(guild_id, []).append((user_id, start_time, deadline))
+            for guild_id, shifts in due.items():
+                self.fired += len(shifts)
+                try:
+                    await self._on_expired(guild_id, shifts)
+                except Exception:
+                    logger.exception(f"Błąd automatycznego zamykania służb (serwer {guild_id})")
+
+    def cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"scheduled": self.scheduled, "fired": self.fired, "in_heap": len(self._heap)}
+
+class RouteBackoff:
+    """Pamięta, które trasy API (np. edycje na kanale) dostały 429 i do kiedy je omijać."""
+
+    def __init__(self, base: float = RATE_LIMIT_BACKOFF_BASE, maximum: float = RATE_LIMIT_BACKOFF_MAX):
+        self.base = base
+        self.maximum = maximum
+        self._until = {}
+        self._delays = {}
+        self.rate_limited = 0
+
+    def remaining(self, route) -> float:
+        until = self._until.get(route)
+        if until is None:
+            return 0.0
+        left = until - asyncio.get_running_loop().time()
+        if left <= 0:
+            del self._until[route]
+            return 0.0
+        return left
+
+    def failed(self, route, retry_after: float = None) -> float:
+        self.rate_limited += 1
+        delay = min(self.maximum, self._delays.get(route, self.base / 2) * 2)
+        if retry_after:
+            delay = max(delay, retry_after)
+        self._delays[route] = delay
+        self._until[route] = asyncio.get_running_loop().time() + delay
+        return delay
+
+    def succeeded(self, route):
+        self._delays.pop(route, None)
+
+    def stats(self) -> dict:
+        return {"429": self.rate_limited, "wycofane_trasy": len(self._until)}
+
+def retry_after_from(error: discord.HTTPException) -> float:
+    try:
+        return float(error.response.headers.get("Retry-After", 0))
+    except (AttributeError, TypeError, ValueError):
+        return 0.0
+
+class StoredUser:
+    """Zastępczy użytkownik do logów, gdy członka nie ma w pamięci bota (nazwa z bazy)."""
+
+    def __init__(self, user_id: int, display_name: str = None):
+        self.id = user_id
+        self.mention = f"<@{user_id}>"
+        self.display_name = display_name or f"ID: {user_id}"
+
 class DutyView(discord.ui.View):
     def __init__(self, cog_instance):
         super().__init__(timeout=None)
@@ -32,20 +317,22 @@ class DutyView(discord.ui.View):
         user = interaction.user
         guild = interaction.guild
 
-        if database.is_user_on_duty(user.id, guild.id):
+        if await database.aio.is_user_on_duty(user.id, guild.id):
             if can_followup:
                 await interaction.followup.send("Jesteś już na służbie!", ephemeral=True)
             return
 
         start_time = datetime.datetime.utcnow()
-        log_message = await self.cog.send_duty_log(guild, user, "on", start_time)
-        log_message_id = log_message.id if log_message else None
+        if not await database.aio.start_duty(user.id, guild.id, start_time):
+            if can_followup:
+                await interaction.followup.send("Jesteś już na służbie!", ephemeral=True)
+            return
 
-        database.add_user_to_duty(user.id, guild.id, start_time, log_message_id)
         if can_followup:
             await interaction.followup.send("Wszedłeś na służbę.", ephemeral=True)
-        database.log_duty_event(guild.id, user.id, "Wszedł na służbę")
-        await self.cog.update_duty_panels(guild)
+        self.cog.queue_duty_start_log(guild, user, start_time)
+        await self.cog.schedule_shift_deadline(guild.id, user.id, start_time)
+        self.cog.request_panel_refresh(guild)
 
     @discord.ui.button(label="Zejdź ze służby", style=discord.ButtonStyle.danger, custom_id="duty_off")
     async def duty_off(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -53,36 +340,166 @@ class DutyView(discord.ui.View):
         user = interaction.user
         guild = interaction.guild
 
-        duty_entry = database.get_user_duty_entry(user.id, guild.id)
-        if not duty_entry:
+        session = await database.aio.end_duty(user.id, guild.id, datetime.datetime.utcnow())
+        if not session:
             if can_followup:
                 await interaction.followup.send("Nie jesteś na służbie!", ephemeral=True)
             return
 
-        start_time = datetime.datetime.fromisoformat(duty_entry['start_time'])
-        duration_seconds = (datetime.datetime.utcnow() - start_time).total_seconds()
-        database.adjust_user_total_duty_seconds(user.id, guild.id, int(duration_seconds))
-        
-        await self.cog.send_duty_log(guild, user, "off", start_time, duty_entry['log_message_id'])
-
-        database.remove_user_from_duty(user.id, guild.id)
         if can_followup:
             await interaction.followup.send("Zszedłeś ze służby.", ephemeral=True)
-        database.log_duty_event(guild.id, user.id, "Zszedł ze służby", f"Czas trwania: {int(duration_seconds)}s")
-        await self.cog.update_duty_panels(guild)
+        self.cog.queue_duty_end_log(guild, user, session)
+        self.cog.request_panel_refresh(guild)
 
 class zmiana(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.poland_tz = pytz.timezone('Europe/Warsaw')
+        self.panel_refresher = PanelRefreshScheduler(self.update_duty_panels)
+        self.route_backoff = RouteBackoff()
+        # Odcisk ostatnio wysłanej treści każdej wiadomości panelu - identycznej nie edytujemy ponownie
+        self.panel_fingerprints = {}
+        self.panel_edits = {"performed": 0, "skipped": 0}
+        self.duty_jobs = DutyJobQueue()
+        self.shift_deadlines = ShiftDeadlineScheduler(self.close_expired_shifts)
+        # ID logów wejścia ((serwer, użytkownik, start) -> ID), których nie udało się zapisać w bazie,
+        # bo służba zakończyła się wcześniej - log zejścia ze służby usuwa wpis po odczytaniu
+        self.start_log_messages = {}
+        # Ostatnio zapisane nazwy wyświetlane ((serwer, użytkownik) -> nazwa), żeby nie zapisywać ich ponownie;
+        # najdawniej używane są usuwane po przekroczeniu KNOWN_NAMES_MAX
+        self.known_names = collections.OrderedDict()
         self.update_loop.start()
         self.bot.add_view(DutyView(self))
+        self.bot.add_dynamic_items(SummaryPageButton)
+
+    async def cog_load(self):
+        self.reconcile_task = asyncio.create_task(self.reconcile_shifts())
 
-    def cog_unload(self):
+    async def cog_unload(self):
         self.update_loop.cancel()
+        self.panel_refresher.cancel()
+        self.reconcile_task.cancel()
+        self.shift_deadlines.cancel()
+        await self.duty_jobs.drain()
+        # Zapisz zbuforowane wpisy logu służby przed wyładowaniem coga
+        await database.aio.flush_duty_logs()
+
+    @commands.Cog.listener()
+    async def on_interaction(self, interaction: discord.Interaction):
+        """Zapamiętuje nazwy wyświetlane użytkownika i osób wskazanych w opcjach komendy."""
+        if interaction.guild is None:
+            return
+        names = {}
+        if isinstance(interaction.user, discord.Member):
+            names[interaction.user.id] = interaction.user.display_name
+        resolved = (interaction.data or {}).get('resolved', {})
+        users = resolved.get('users', {})
+        for user_id, member_data in resolved.get('members', {}).items():
+            user_data = users.get(user_id, {})
+            name = member_data.get('nick') or user_data.get('global_name') or user_data.get('username')
+            if name:
+                names[int(user_id)] = name
+        await self.remember_names(interaction.guild.id, names)
+
+    async def remember_names(self, guild_id: int, names: dict):
+        changed = []
+        for user_id, name in names.items():
+            key = (guild_id, user_id)
+            if self.known_names.get(key) == name:
+                self.known_names.move_to_end(key)
+            else:
+                changed.append((user_id, name))
+        if not changed:
+            return
+        await database.aio.set_user_names(guild_id, changed)
+        for user_id, name in changed:
+            self.known_names[(guild_id, user_id)] = name
+            self.known_names.move_to_end((guild_id, user_id))
+        while len(self.known_names) > KNOWN_NAMES_MAX:
+            self.known_names.popitem(last=False)
+
+    async def display_names(self, guild: discord.Guild, user_ids) -> dict:
+        """Nazwy wyświetlane z bazy ({user_id: nazwa}); brakujące uzupełnia z pamięci podręcznej członków."""
+        names = await database.aio.get_user_names(guild.id, user_ids)
+        for user_id in user_ids:
+            if user_id not in names:
+                member = guild.get_member(user_id)
+                if member:
+                    names[user_id] = member.display_name
+        return names
+
+    def request_panel_refresh(self, guild: discord.Guild):
+        """Zleca odświeżenie paneli służby serwera (żądania z krótkiego okresu są łączone)."""
+        self.panel_refresher.request(guild)
+
+    async def reconcile_shifts(self):
+        """Po starcie: zamyka (jedną transakcją na serwer) służby ponad limit i planuje terminy pozostałych."""
+        await self.bot.wait_until_ready()
+        for panel_info in await database.aio.get_all_duty_panels():
+            if panel_info['max_shift_minutes']:
+                await self.schedule_guild_shifts(panel_info['guild_id'], panel_info['max_shift_minutes'])
 
-    async def send_duty_log(self, guild: discord.Guild, user: discord.Member, event_type: str, start_time: datetime.datetime, log_message_id: int = None, odwolal: discord.Member = None):
-        panel_info = database.get_duty_panel(guild.id)
+    async def schedule_guild_shifts(self, guild_id: int, max_minutes: int):
+        """Planuje od nowa terminy wszystkich otwartych służb serwera; przeterminowane zamyka od razu."""
+        self.shift_deadlines.reset_guild(guild_id)
+        if not max_minutes:
+            return
+        limit = datetime.timedelta(minutes=max_minutes)
+        now = datetime.datetime.utcnow()
+        expired = []
+        for user_row in await database.aio.get_on_duty_users(guild_id):
+            start_time = datetime.datetime.fromisoformat(user_row['start_time'])
+            if start_time + limit <= now:
+                expired.append((user_row['user_id'], start_time, start_time + limit))
+            else:
+                self.shift_deadlines.schedule(guild_id, user_row['user_id'], start_time, start_time + limit)
+        if expired:
+            await self.close_expired_shifts(guild_id, expired)
+
+    async def schedule_shift_deadline(self, guild_id: int, user_id: int, start_time: datetime.datetime):
+        panel_info = await database.aio.get_duty_panel(guild_id)
+        if panel_info and panel_info['max_shift_minutes']:
+            deadline = start_time + datetime.timedelta(minutes=panel_info['max_shift_minutes'])
+            self.shift_deadlines.schedule(guild_id, user_id, start_time, deadline)
+
+    async def close_expired_shifts(self, guild_id: int, shifts):
+        """Zamyka służby po limicie (liczony jest czas do terminu, nie do teraz) i zleca ich logi."""
+        sessions = await database.aio.end_expired_duties(guild_id, shifts, action="Automatycznie zakończono służbę (limit czasu)")
+        guild = self.bot.get_guild(guild_id)
+        if not sessions or guild is None:
+            return
+        names = await self.display_names(guild, list(sessions))
+        for user_id, session in sessions.items():
+            user = guild.get_member(user_id) or StoredUser(user_id, names.get(user_id))
+            self.queue_duty_end_log(guild, user, session)
+        logger.info(f"Automatycznie zakończono {len(sessions)} służb po limicie czasu (serwer {guild_id}).")
+        self.request_panel_refresh(guild)
+
+    def queue_duty_start_log(self, guild: discord.Guild, user: discord.Member, start_time: datetime.datetime):
+        """Zleca wysłanie logu wejścia na służbę i zapisanie ID wiadomości przy aktywnej służbie."""
+        async def job():
+            message = await self.send_duty_log(guild, user, "on", start_time)
+            if message is None:
+                return
+            key = (guild.id, user.id, start_time)
+            self.start_log_messages[key] = message.id
+            if await database.aio.set_active_log_message(user.id, guild.id, start_time, message.id):
+                # ID jest już w bazie - zejście ze służby odczyta je stamtąd
+                del self.start_log_messages[key]
+
+        self.duty_jobs.submit((guild.id, user.id), job, f"log wejścia na służbę ({user.id})")
+
+    def queue_duty_end_log(self, guild: discord.Guild, user: discord.Member, session: dict, odwolal: discord.Member = None):
+        """Zleca edycję (albo wysłanie) logu zakończonej służby - po ewentualnym logu wejścia tej osoby."""
+        async def job():
+            fallback_id = self.start_log_messages.pop((guild.id, user.id, session['start_time']), None)
+            log_message_id = session['log_message_id'] or fallback_id
+            await self.send_duty_log(guild, user, "off", session['start_time'], log_message_id, odwolal=odwolal, session=session)
+
+        self.duty_jobs.submit((guild.id, user.id), job, f"log zejścia ze służby ({user.id})")
+
+    async def send_duty_log(self, guild: discord.Guild, user: discord.Member, event_type: str, start_time: datetime.datetime, log_message_id: int = None, odwolal: discord.Member = None, session: dict = None):
+        panel_info = await database.aio.get_duty_panel(guild.id)
         if not panel_info or not panel_info['log_channel_id']:
             return None
 
@@ -106,61 +523,87 @@ class zmiana(commands.Cog):
                 logger.warning(f"Brak uprawnień do wysyłania wiadomości na kanale logów służby (ID: {log_channel.id})")
                 return None
 
-        elif event_type == "off" and log_message_id:
-            try:
-                message = await log_channel.fetch_message(log_message_id)
+        elif event_type == "off":
+            if session:
+                end_time = session['end_time']
+                duration_seconds = session['duration_seconds']
+                total_seconds_user = session['total_duty_seconds']
+            else:
                 end_time = datetime.datetime.utcnow()
-                end_timestamp = f"<t:{int(end_time.timestamp())}:F>"
                 duration_seconds = (end_time - start_time).total_seconds()
-                total_seconds_user = database.get_user_total_duty_seconds(user.id, guild.id)
+                total_seconds_user = await database.aio.get_user_total_duty_seconds(user.id, guild.id)
+            embed = self.build_duty_off_embed(user, start_time, end_time, duration_seconds, total_seconds_user, odwolal)
 
-                h, rem = divmod(duration_seconds, 3600)
-                m, s = divmod(rem, 60)
-                duration_str = f"{int(h)}h {int(m)}m {int(s)}s"
-
-                th, trem = divmod(total_seconds_user, 3600)
-                tm, ts = divmod(trem, 60)
-                total_duration_str = f"{int(th)}h {int(tm)}m"
-
-                embed = message.embeds[0]
-                embed.title = "✅ Służba zakończona"
-                embed.color = discord.Color.greyple()
-                embed.clear_fields()
-                embed.add_field(name="Czas wejścia", value=start_timestamp, inline=False)
-                embed.add_field(name="Czas zejścia", value=end_timestamp, inline=False)
-                embed.add_field(name="Czas trwania służby", value=duration_str, inline=True)
-                embed.add_field(name="Łączny czas na służbie", value=total_duration_str, inline=True)
-                if odwolal:
-                    embed.add_field(name="Odwołany przez", value=odwolal.mention, inline=False)
-                
-                await message.edit(embed=embed)
-                return message
+            try:
+                if log_message_id:
+                    # Edycja przez referencję z zapisanego ID - bez pobierania wiadomości
+                    return await log_channel.get_partial_message(log_message_id).edit(embed=embed)
             except discord.NotFound:
-                logger.warning(f"Nie znaleziono wiadomości logu (ID: {log_message_id}) do edycji.")
-                return None
+                logger.warning(f"Nie znaleziono wiadomości logu (ID: {log_message_id}) do edycji - wysyłam nową.")
             except discord.Forbidden:
                 logger.warning(f"Brak uprawnień do edycji wiadomości na kanale logów służby (ID: {log_channel.id})")
                 return None
+            try:
+                return await log_channel.send(embed=embed)
+            except discord.Forbidden:
+                logger.warning(f"Brak uprawnień do wysyłania wiadomości na kanale logów służby (ID: {log_channel.id})")
+                return None
         return None
 
+    def build_duty_off_embed(self, user: discord.abc.User, start_time: datetime.datetime, end_time: datetime.datetime, duration_seconds: float, total_seconds_user: int, odwolal: discord.Member = None) -> discord.Embed:
+        """Buduje embed zakończonej służby wyłącznie z danych sesji (bez czytania starej wiadomości)."""
+        start_timestamp = f"<t:{int(start_time.timestamp())}:F>"
+        end_timestamp = f"<t:{int(end_time.timestamp())}:F>"
+
+        h, rem = divmod(duration_seconds, 3600)
+        m, s = divmod(rem, 60)
+        duration_str = f"{int(h)}h {int(m)}m {int(s)}s"
+
+        th, trem = divmod(total_seconds_user, 3600)
+        tm, ts = divmod(trem, 60)
+        total_duration_str = f"{int(th)}h {int(tm)}m"
+
+        embed = discord.Embed(
+            title="✅ Służba zakończona",
+            description=f"**Użytkownik:** {user.mention} ({user.display_name})",
+            color=discord.Color.greyple()
+        )
+        embed.add_field(name="Czas wejścia", value=start_timestamp, inline=False)
+        embed.add_field(name="Czas zejścia", value=end_timestamp, inline=False)
+        embed.add_field(name="Czas trwania służby", value=duration_str, inline=True)
+        embed.add_field(name="Łączny czas na służbie", value=total_duration_str, inline=True)
+        if odwolal:
+            embed.add_field(name="Odwołany przez", value=odwolal.mention, inline=False)
+        return embed
+
     import asyncio
 
 # ... (reszta importów)
 
 # ... (reszta kodu)
 
-    @tasks.loop(minutes=5)  # Zwiększono interwał do 5 minut
+    @tasks.loop(minutes=UPDATE_LOOP_MINUTES)
     async def update_loop(self):
         await self.bot.wait_until_ready()
-        all_panels = database.get_all_duty_panels()
-        for panel_info in all_panels:
-            guild = self.bot.get_guild(panel_info['guild_id'])
-            if guild:
-                await self.update_duty_panels(guild)
-            await asyncio.sleep(0) # Dodano sleep, aby oddać kontrolę pętli zdarzeń
+        all_panels = await database.aio.get_all_duty_panels()
+        # Panele z czasem względnym odliczają się po stronie klienta - edytujemy je tylko przy zmianach
+        guilds = [
+            guild for guild in (self.bot.get_guild(panel_info['guild_id']) for panel_info in all_panels
+                                if not panel_info['relative_timestamps'])
+            if guild
+        ]
+        if not guilds:
+            return
+        # Rozkładamy serwery równomiernie na interwał zamiast odświeżać wszystkie naraz;
+        # same odświeżenia działają współbieżnie (z limitem) w PanelRefreshScheduler,
+        # więc wolny serwer nie opóźnia pozostałych.
+        spacing = UPDATE_LOOP_MINUTES * 60 * UPDATE_LOOP_SPREAD / len(guilds)
+        for guild in guilds:
+            self.request_panel_refresh(guild)
+            await asyncio.sleep(spacing)
 
     async def update_duty_panels(self, guild: discord.Guild):
-        panel_info = database.get_duty_panel(guild.id)
+        panel_info = await database.aio.get_duty_panel(guild.id)
         if not panel_info or not panel_info['channel_id']:
             return
 
@@ -168,54 +611,114 @@ class zmiana(commands.Cog):
         if not channel:
             return
 
+        wait = self.route_backoff.remaining(("panel", channel.id))
+        if wait > 0:
+            self.panel_refresher.request_after(guild, wait)
+            return
+
         active_embed = discord.Embed(title="Aktywni na służbie", color=discord.Color.blue())
-        guild_users_on_duty = database.get_on_duty_users(guild.id)
+        guild_users_on_duty = await database.aio.get_on_duty_users(guild.id)
         if not guild_users_on_duty:
             active_description = "Nikt aktualnie nie jest na służbie."
         else:
             active_lines = []
             now = datetime.datetime.utcnow()
+            names = await self.display_names(guild, [user_row['user_id'] for user_row in guild_users_on_duty])
             for user_row in guild_users_on_duty:
-                member = guild.get_member(user_row['user_id'])
-                if member:
-                    start_time = datetime.datetime.fromisoformat(user_row['start_time'])
-                    duration = now - start_time
-                    h, rem = divmod(duration.total_seconds(), 3600)
-                    m, s = divmod(rem, 60)
-                    active_lines.append(f"{member.display_name} - {int(h):02}:{int(m):02}")
+                name = names.get(user_row['user_id'], f"<@{user_row['user_id']}>")
+                start_time = datetime.datetime.fromisoformat(user_row['start_time'])
+                if panel_info['relative_timestamps']:
+                    start_epoch = int(start_time.replace(tzinfo=datetime.timezone.utc).timestamp())
+                    active_lines.append(f"{name} - od <t:{start_epoch}:R>")
+                    continue
+                duration = now - start_time
+                h, rem = divmod(duration.total_seconds(), 3600)
+                m, s = divmod(rem, 60)
+                active_lines.append(f"{name} - {int(h):02}:{int(m):02}")
             active_description = "\n".join(active_lines)
         active_embed.description = active_description
 
-        try:
-            active_message = await channel.fetch_message(panel_info['active_message_id'])
-            await active_message.edit(embed=active_embed) # Usunięto view=DutyView(self)
-        except discord.NotFound:
-            pass
-
-        summary_embed = discord.Embed(title="Podsumowanie godzin służby", color=discord.Color.green())
-        all_total_duty = database.get_all_total_duty_seconds(guild.id)
-        
-        sorted_duty = sorted(all_total_duty, key=lambda x: x['total_duty_seconds'], reverse=True)
-
-        if not sorted_duty:
-            total_description = "Brak zarejestrowanych godzin służby."
-        else:
-            total_lines = []
-            for user_row in sorted_duty:
-                member = guild.get_member(user_row['user_id'])
-                if member:
-                    total_seconds = user_row['total_duty_seconds']
-                    h, rem = divmod(total_seconds, 3600)
-                    m, s = divmod(rem, 60)
-                    total_lines.append(f"{member.display_name}: {int(h):02}h {int(m):02}m")
-            total_description = "\n".join(total_lines)
-        summary_embed.description = total_description
+        await self.edit_panel_message(guild, channel, panel_info, 'active_message_id', active_embed, view=DutyView(self))
+        if self.route_backoff.remaining(("panel", channel.id)) > 0:
+            return
 
+        summary_embed, summary_view = await self.render_summary_page(guild, 0)
+        await self.edit_panel_message(guild, channel, panel_info, 'summary_message_id', summary_embed, view=summary_view)
+
+    async def edit_panel_message(self, guild: discord.Guild, channel: discord.TextChannel, panel_info, column: str, embed: discord.Embed, view: discord.ui.View = None):
+        """
+        Edytuje wiadomość panelu przez referencję z zapisanego ID (bez fetch_message).
+        Jeśli wiadomość zniknęła, wysyła nową i zapisuje jej ID w bazie.
+        """
+        message_id = panel_info[column]
+        fingerprint = self.panel_fingerprint(embed, view)
+        if message_id and self.panel_fingerprints.get(message_id) == fingerprint:
+            self.panel_edits["skipped"] += 1
+            return
+        if message_id:
+            try:
+                if view is not None:
+                    await channel.get_partial_message(message_id).edit(embed=embed, view=view)
+                else:
+                    await channel.get_partial_message(message_id).edit(embed=embed)
+                self.route_backoff.succeeded(("panel", channel.id))
+                self.panel_fingerprints[message_id] = fingerprint
+                self.panel_edits["performed"] += 1
+                return
+            except discord.NotFound:
+                logger.warning(f"Wiadomość panelu służby (ID: {message_id}) nie istnieje - tworzę nową.")
+            except discord.Forbidden:
+                logger.warning(f"Brak uprawnień do edycji panelu służby na kanale (ID: {channel.id})")
+                return
+            except discord.HTTPException as e:
+                if e.status != 429:
+                    raise
+                delay = self.route_backoff.failed(("panel", channel.id), retry_after_from(e))
+                logger.warning(f"Limit zapytań przy edycji panelu (kanał {channel.id}) - ponowienie za {delay:.0f}s.")
+                self.panel_refresher.request_after(guild, delay)
+                return
         try:
-            summary_message = await channel.fetch_message(panel_info['summary_message_id'])
-            await summary_message.edit(embed=summary_embed)
-        except discord.NotFound:
-            pass
+            if view is not None:
+                message = await channel.send(embed=embed, view=view)
+            else:
+                message = await channel.send(embed=embed)
+        except discord.Forbidden:
+            logger.warning(f"Brak uprawnień do wysłania panelu służby na kanale (ID: {channel.id})")
+            return
+        self.panel_fingerprints.pop(message_id, None)
+        self.panel_fingerprints[message.id] = fingerprint
+        self.panel_edits["performed"] += 1
+        await database.aio.set_duty_panel_message(guild.id, column, message.id)
+
+    @staticmethod
+    def panel_fingerprint(embed: discord.Embed, view: discord.ui.View = None) -> str:
+        content = {"embed": embed.to_dict(), "components": view.to_components() if view is not None else None}
+        return hashlib.sha1(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+    async def render_summary_page(self, guild: discord.Guild, page: int):
+        """
+        Renderuje jedną stronę rankingu godzin (LIMIT/OFFSET po indeksie), więc koszt
+        zależy od rozmiaru strony, a nie od liczby osób w rankingu.
+        Zwraca (embed, widok z przyciskami); numer strony jest zapisany w custom_id przycisków.
+        """
+        total = await database.aio.count_duty_users(guild.id)
+        pages = max(1, -(-total // SUMMARY_PAGE_SIZE))
+        page = min(max(page, 0), pages - 1)
+
+        offset = page * SUMMARY_PAGE_SIZE
+        rows = await database.aio.get_top_duty_users(guild.id, SUMMARY_PAGE_SIZE, offset)
+        lines = []
+        names = await self.display_names(guild, [user_row['user_id'] for user_row in rows])
+        for rank, user_row in enumerate(rows, start=offset + 1):
+            name = names.get(user_row['user_id'], f"<@{user_row['user_id']}>")
+            h, rem = divmod(user_row['total_duty_seconds'], 3600)
+            m, s = divmod(rem, 60)
+            lines.append(f"{rank}. {name}: {int(h):02}h {int(m):02}m")
+
+        embed = discord.Embed(title="Podsumowanie godzin służby", color=discord.Color.green())
+        embed.description = "\n".join(lines) if lines else "Brak zarejestrowanych godzin służby."
+        embed.set_footer(text=f"Strona {page + 1}/{pages}")
+        return embed, summary_page_view(page, pages)
 
     @app_commands.command(name="setup_zmiana", description="Ustawia panel do zarządzania zmianą na danym kanale.")
     @app_commands.checks.has_permissions(administrator=True)
@@ -229,12 +732,12 @@ class zmiana(commands.Cog):
         try:
             active_message = await channel.send(embed=active_embed, view=view)
             summary_embed = discord.Embed(title="Podsumowanie godzin służby", description="Brak zarejestrowanych godzin służby.", color=discord.Color.green())
-            summary_message = await channel.send(embed=summary_embed)
+            summary_message = await channel.send(embed=summary_embed, view=summary_page_view(0, 1))
         except discord.Forbidden:
             await interaction.followup.send("Nie mam uprawnień do wysyłania wiadomości na tym kanale.", ephemeral=True)
             return
 
-        database.set_duty_panel(interaction.guild.id, channel.id, active_message.id, summary_message.id)
+        await database.aio.set_duty_panel(interaction.guild.id, channel.id, active_message.id, summary_message.id)
         await interaction.followup.send(f"Panel służby został pomyślnie ustawiony na kanale {channel.mention}.", ephemeral=True)
 
     @app_commands.command(name="setup_logi_sluzby", description="Ustawia kanał, na który będą wysyłane logi wejść i zejść ze służby.")
@@ -244,9 +747,46 @@ class zmiana(commands.Cog):
         if not can_followup:
             return
             
-        database.set_duty_log_channel(interaction.guild.id, channel.id)
+        await database.aio.set_duty_log_channel(interaction.guild.id, channel.id)
         await interaction.followup.send(f"Kanał logów służby został ustawiony na {channel.mention}.", ephemeral=True)
 
+    @app_commands.command(name="tryb_panelu_sluzby", description="Przełącza panel aktywnych między czasem trwania a czasem względnym.")
+    @app_commands.describe(czas_wzgledny="Tak - czas liczony przez Discorda (<t:...:R>), panel edytowany tylko przy zmianach")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def tryb_panelu_sluzby(self, interaction: discord.Interaction, czas_wzgledny: bool):
+        can_followup = await handle_interaction_error(interaction)
+        if not can_followup:
+            return
+
+        panel_info = await database.aio.get_duty_panel(interaction.guild.id)
+        if not panel_info:
+            await interaction.followup.send("Najpierw ustaw panel służby komendą /setup_zmiana.", ephemeral=True)
+            return
+        await database.aio.set_duty_panel_relative_timestamps(interaction.guild.id, czas_wzgledny)
+        self.request_panel_refresh(interaction.guild)
+        mode = "czas względny (bez okresowych edycji)" if czas_wzgledny else "czas trwania (odświeżany co kilka minut)"
+        await interaction.followup.send(f"Tryb panelu aktywnych: {mode}.", ephemeral=True)
+
+    @app_commands.command(name="limit_sluzby", description="Ustawia, po ilu godzinach służba jest automatycznie kończona.")
+    @app_commands.describe(hours="Maksymalna długość służby w godzinach (0 - bez limitu)", minutes="Dodatkowe minuty")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def limit_sluzby(self, interaction: discord.Interaction, hours: int, minutes: int = 0):
+        can_followup = await handle_interaction_error(interaction)
+        if not can_followup:
+            return
+
+        guild_id = interaction.guild.id
+        if not await database.aio.get_duty_panel(guild_id):
+            await interaction.followup.send("Najpierw ustaw panel służby komendą /setup_zmiana.", ephemeral=True)
+            return
+        max_minutes = max(0, hours * 60 + minutes) or None
+        await database.aio.set_duty_panel_max_shift(guild_id, max_minutes)
+        await self.schedule_guild_shifts(guild_id, max_minutes)
+        if max_minutes:
+            await interaction.followup.send(f"Służby będą automatycznie kończone po {hours}h {minutes}m.", ephemeral=True)
+        else:
+            await interaction.followup.send("Wyłączono automatyczne kończenie służb.", ephemeral=True)
+
     @app_commands.command(name="odwolaj_ze_sluzby", description="Odwołuje użytkownika ze służby.")
     @app_commands.describe(uzytkownik="Osoba do odwołania ze służby")
     async def odwolaj_ze_sluzby(self, interaction: discord.Interaction, uzytkownik: discord.Member):
@@ -258,20 +798,16 @@ class zmiana(commands.Cog):
             await interaction.followup.send("Nie masz uprawnień do używania tej komendy.", ephemeral=True)
             return
 
-        duty_entry = database.get_user_duty_entry(uzytkownik.id, interaction.guild.id)
-        if not duty_entry:
+        session = await database.aio.end_duty(
+            uzytkownik.id, interaction.guild.id, datetime.datetime.utcnow(),
+            action="Odwołany ze służby", details=f"Przez: {interaction.user.name}", ended_by=interaction.user.id
+        )
+        if not session:
             await interaction.followup.send(f"{uzytkownik.mention} nie jest na służbie.", ephemeral=True)
             return
 
-        start_time = datetime.datetime.fromisoformat(duty_entry['start_time'])
-        duration_seconds = (datetime.datetime.utcnow() - start_time).total_seconds()
-        database.adjust_user_total_duty_seconds(uzytkownik.id, interaction.guild.id, int(duration_seconds))
-        
-        await self.send_duty_log(interaction.guild, uzytkownik, "off", start_time, duty_entry['log_message_id'], odwolal=interaction.user)
-
-        database.remove_user_from_duty(uzytkownik.id, interaction.guild.id)
-        database.log_duty_event(interaction.guild.id, uzytkownik.id, "Odwołany ze służby", f"Przez: {interaction.user.name}")
-        await self.update_duty_panels(interaction.guild)
+        self.queue_duty_end_log(interaction.guild, uzytkownik, session, odwolal=interaction.user)
+        self.request_panel_refresh(interaction.guild)
         await interaction.followup.send(f"Pomyślnie odwołano {uzytkownik.mention} ze służby.", ephemeral=True)
 
     @app_commands.command(name="reset_godzin", description="Resetuje sumę godzin służby dla wszystkich użytkowników.")
@@ -282,9 +818,9 @@ class zmiana(commands.Cog):
             return
 
         guild_id = interaction.guild.id
-        database.reset_all_total_duty_seconds(guild_id)
-        database.log_duty_event(guild_id, interaction.user.id, "Użyto komendy reset_godzin")
-        await self.update_duty_panels(interaction.guild)
+        await database.aio.reset_all_total_duty_seconds(guild_id)
+        await database.aio.log_duty_event(guild_id, interaction.user.id, "Użyto komendy reset_godzin")
+        self.request_panel_refresh(interaction.guild)
         await interaction.followup.send("Suma godzin służby została zresetowana dla wszystkich użytkowników.", ephemeral=True)
 
     @app_commands.command(name="ustaw_godziny_osoby", description="Ustawia godziny służby dla konkretnej osoby.")
@@ -296,9 +832,9 @@ class zmiana(commands.Cog):
 
         guild_id = interaction.guild.id
         total_seconds = (hours * 3600) + (minutes * 60)
-        database.set_user_total_duty_seconds(user.id, guild_id, total_seconds)
-        database.log_duty_event(guild_id, interaction.user.id, "Ustawiono godziny służby", f"Użytkownik: {user.display_name}, Godziny: {hours}h {minutes}m")
-        await self.update_duty_panels(interaction.guild)
+        await database.aio.set_user_total_duty_seconds(user.id, guild_id, total_seconds)
+        await database.aio.log_duty_event(guild_id, interaction.user.id, "Ustawiono godziny służby", f"Użytkownik: {user.display_name}, Godziny: {hours}h {minutes}m")
+        self.request_panel_refresh(interaction.guild)
         await interaction.followup.send(f"Ustawiono {hours}h {minutes}m służby dla {user.mention}.", ephemeral=True)
 
     @app_commands.command(name="dodaj_godziny_osoby", description="Dodaje godziny służby do konkretnej osoby.")
@@ -310,9 +846,9 @@ class zmiana(commands.Cog):
 
         guild_id = interaction.guild.id
         seconds_to_add = (hours * 3600) + (minutes * 60)
-        database.adjust_user_total_duty_seconds(user.id, guild_id, seconds_to_add)
-        database.log_duty_event(guild_id, interaction.user.id, "Dodano godziny służby", f"Użytkownik: {user.display_name}, Dodano: {hours}h {minutes}m")
-        await self.update_duty_panels(interaction.guild)
+        await database.aio.adjust_user_total_duty_seconds(user.id, guild_id, seconds_to_add)
+        await database.aio.log_duty_event(guild_id, interaction.user.id, "Dodano godziny służby", f"Użytkownik: {user.display_name}, Dodano: {hours}h {minutes}m")
+        self.request_panel_refresh(interaction.guild)
         await interaction.followup.send(f"Dodano {hours}h {minutes}m służby dla {user.mention}.", ephemeral=True)
 
     @app_commands.command(name="odejmij_godziny_osoby", description="Odejmuje godziny służby od konkretnej osoby.")
@@ -324,9 +860,9 @@ class zmiana(commands.Cog):
 
         guild_id = interaction.guild.id
         seconds_to_remove = -((hours * 3600) + (minutes * 60))
-        database.adjust_user_total_duty_seconds(user.id, guild_id, seconds_to_remove)
-        database.log_duty_event(guild_id, interaction.user.id, "Odjęto godziny służby", f"Użytkownik: {user.display_name}, Odjęto: {hours}h {minutes}m")
-        await self.update_duty_panels(interaction.guild)
+        await database.aio.adjust_user_total_duty_seconds(user.id, guild_id, seconds_to_remove)
+        await database.aio.log_duty_event(guild_id, interaction.user.id, "Odjęto godziny służby", f"Użytkownik: {user.display_name}, Odjęto: {hours}h {minutes}m")
+        self.request_panel_refresh(interaction.guild)
         await interaction.followup.send(f"Odjęto {hours}h {minutes}m służby od {user.mention}.", ephemeral=True)
 
     @app_commands.command(name="resetuj_godziny_osoby", description="Resetuje godziny służby dla konkretnej osoby.")
@@ -337,39 +873,296 @@ class zmiana(commands.Cog):
             return
 
         guild_id = interaction.guild.id
-        database.reset_user_total_duty_seconds(user.id, guild_id)
-        database.log_duty_event(guild_id, interaction.user.id, "Zresetowano godziny służby osoby", f"Użytkownik: {user.display_name}")
-        await self.update_duty_panels(interaction.guild)
+        await database.aio.reset_user_total_duty_seconds(user.id, guild_id)
+        await database.aio.log_duty_event(guild_id, interaction.user.id, "Zresetowano godziny służby osoby", f"Użytkownik: {user.display_name}")
+        self.request_panel_refresh(interaction.guild)
         await interaction.followup.send(f"Zresetowano godziny służby dla {user.mention}.", ephemeral=True)
 
-    @app_commands.command(name="pokaz_logi_sluzby", description="Pokazuje ostatnie logi zdarzeń służby.")
+    @app_commands.command(name="godziny_zbiorczo", description="Zmienia godziny służby wszystkim osobom z roli lub z listy naraz.")
+    @app_commands.describe(
+        operacja="Co zrobić z godzinami",
+        rola="Wszyscy członkowie tej roli",
+        osoby="Wzmianki lub ID osób oddzielone spacjami",
+        hours="Godziny (nie dotyczy resetu)",
+        minutes="Minuty (nie dotyczy resetu)"
+    )
+    @app_commands.choices(operacja=[
+        app_commands.Choice(name="Ustaw", value="ustaw"),
+        app_commands.Choice(name="Dodaj", value="dodaj"),
+        app_commands.Choice(name="Odejmij", value="odejmij"),
+        app_commands.Choice(name="Resetuj", value="resetuj"),
+    ])
     @app_commands.checks.has_permissions(administrator=True)
-    async def show_duty_logs(self, interaction: discord.Interaction, limit: int = 10):
+    async def bulk_person_hours(self, interaction: discord.Interaction, operacja: app_commands.Choice[str], rola: discord.Role = None, osoby: str = None, hours: int = 0, minutes: int = 0):
         can_followup = await handle_interaction_error(interaction)
         if not can_followup:
             return
 
-        guild_id = interaction.guild.id
-        logs = database.get_duty_logs(guild_id, limit)
-        if not logs:
+        guild = interaction.guild
+        names = {}
+        if rola is not None:
+            try:
+                # Pobranie członków jednego serwera na żądanie (bez trzymania ich w pamięci bota)
+                members = await guild.chunk(cache=False)
+            except discord.ClientException:
+                # Bez intencji członków (MEMBERS_INTENT) nie da się pobrać członków roli
+                await interaction.followup.send("Bot nie ma dostępu do listy członków serwera (wyłączona intencja członków) - podaj osoby ręcznie.", ephemeral=True)
+                return
+            names.update((member.id, member.display_name) for member in members if rola in member.roles)
+            await self.remember_names(guild.id, names)
+        if osoby:
+            listed = [int(user_id) for user_id in re.findall(r"\d{15,20}", osoby)]
+            stored = await self.display_names(guild, [user_id for user_id in listed if user_id not in names])
+            names.update((user_id, stored.get(user_id, f"ID: {user_id}")) for user_id in listed if user_id not in names)
+        if not names:
+            await interaction.followup.send("Nie wskazano żadnych osób (podaj rolę lub listę osób).", ephemeral=True)
+            return
+
+        seconds = (hours * 3600) + (minutes * 60)
+        if operacja.value == "ustaw":
+            mode, action, details = 'set', "Ustawiono godziny służby", f"Godziny: {hours}h {minutes}m"
+        elif operacja.value == "dodaj":
+            mode, action, details = 'add', "Dodano godziny służby", f"Dodano: {hours}h {minutes}m"
+        elif operacja.value == "odejmij":
+            mode, action, details, seconds = 'add', "Odjęto godziny służby", f"Odjęto: {hours}h {minutes}m", -seconds
+        else:
+            mode, action, details = 'reset', "Zresetowano godziny służby osoby", None
+
+        targets = [
+            (user_id, f"Użytkownik: {name}, {details}" if details else f"Użytkownik: {name}")
+            for user_id, name in names.items()
+        ]
+        changed = await database.aio.bulk_update_duty_seconds(guild.id, mode, seconds, interaction.user.id, action, targets)
+        self.request_panel_refresh(guild)
+        await interaction.followup.send(f"{operacja.name}: zmieniono godziny {changed} z {len(targets)} osób.", ephemeral=True)
+
+    @app_commands.command(name="moje_godziny", description="Pokazuje Twoją sumę godzin służby i miejsce w rankingu.")
+    async def my_hours(self, interaction: discord.Interaction):
+        can_followup = await handle_interaction_error(interaction)
+        if not can_followup:
+            return
+
+        rank = await database.aio.get_user_duty_rank(interaction.user.id, interaction.guild.id)
+        if rank is None:
+            await interaction.followup.send("Nie masz jeszcze zarejestrowanych godzin służby.", ephemeral=True)
+            return
+
+        position, total_seconds = rank
+        h, rem = divmod(total_seconds, 3600)
+        m, s = divmod(rem, 60)
+        await interaction.followup.send(f"Masz {int(h):02}h {int(m):02}m służby - {position}. miejsce w rankingu.", ephemeral=True)
+
+    @app_commands.command(name="raport_sluzby", description="Pokazuje czas służby w bieżącym i poprzednim dniu, tygodniu i miesiącu.")
+    @app_commands.describe(uzytkownik="Osoba, dla której pokazać raport (domyślnie Ty)")
+    async def duty_report(self, interaction: discord.Interaction, uzytkownik: discord.Member = None):
+        can_followup = await handle_interaction_error(interaction)
+        if not can_followup:
+            return
+
+        target = uzytkownik or interaction.user
+        if target.id != interaction.user.id and not interaction.user.guild_permissions.administrator:
+            await interaction.followup.send("Możesz sprawdzić tylko własny raport.", ephemeral=True)
+            return
+
+        report = await database.aio.get_duty_report(interaction.guild.id, target.id)
+
+        def fmt(seconds):
+            h, rem = divmod(seconds, 3600)
+            m, s = divmod(rem, 60)
+            return f"{int(h):02}h {int(m):02}m"
+
+        embed = discord.Embed(title="Raport służby", description=f"**Użytkownik:** {target.mention}", color=discord.Color.blue())
+        for period, current_label, previous_label in [('day', "Dzisiaj", "Wczoraj"),
+                                                      ('week', "Ten tydzień", "Poprzedni tydzień"),
+                                                      ('month', "Ten miesiąc", "Poprzedni miesiąc")]:
+            embed.add_field(name=current_label, value=fmt(report[(period, 'current')]), inline=True)
+            embed.add_field(name=previous_label, value=fmt(report[(period, 'previous')]), inline=True)
+            embed.add_field(name="\u200b", value="\u200b", inline=True)
+        await interaction.followup.send(embed=embed, ephemeral=True)
+
+    @app_commands.command(name="eksport_sluzby", description="Eksportuje logi lub statystyki służby do skompresowanego pliku.")
+    @app_commands.describe(tabela="Dane do wyeksportowania", format="Format pliku")
+    @app_commands.choices(
+        tabela=[app_commands.Choice(name="Logi służby", value="duty_logs"),
+                app_commands.Choice(name="Statystyki godzin", value="user_duty_stats")],
+        format=[app_commands.Choice(name="CSV", value="csv"),
+                app_commands.Choice(name="JSONL", value="jsonl")]
+    )
+    @app_commands.checks.has_permissions(administrator=True)
+    async def export_duty_data(self, interaction: discord.Interaction, tabela: app_commands.Choice[str], format: app_commands.Choice[str]):
+        can_followup = await handle_interaction_error(interaction)
+        if not can_followup:
+            return
+
+        filename = f"{tabela.value}_{interaction.guild.id}.{format.value}.gz"
+        fd, path = tempfile.mkstemp(suffix=".gz")
+        os.close(fd)
+        try:
+            count = await database.aio.export_guild_table(tabela.value, interaction.guild.id, path, format.value)
+            size = os.path.getsize(path)
+            if size > interaction.guild.filesize_limit:
+                await interaction.followup.send(f"Plik eksportu ({size // 1024} KiB) przekracza limit załączników serwera.", ephemeral=True)
+                return
+            await interaction.followup.send(
+                f"Wyeksportowano {count} wierszy.",
+                file=discord.File(path, filename=filename),
+                ephemeral=True
+            )
+        finally:
+            os.remove(path)
+
+    @app_commands.command(name="statystyki_wydajnosci", description="Pokazuje liczniki wydajności systemu służby.")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def performance_stats(self, interaction: discord.Interaction):
+        can_followup = await handle_interaction_error(interaction)
+        if not can_followup:
+            return
+
+        embed = discord.Embed(title="Statystyki wydajności", color=discord.Color.dark_grey())
+        for name, stats in self.collect_metrics().items():
+            embed.add_field(name=name, value="\n".join(f"{key}: {value}" for key, value in stats.items()), inline=True)
+        await interaction.followup.send(embed=embed, ephemeral=True)
+
+    def collect_metrics(self) -> dict:
+        return {
+            "Odświeżenia paneli": self.panel_refresher.stats(),
+            "Edycje paneli": dict(self.panel_edits),
+            "Limity zapytań": self.route_backoff.stats(),
+            "Kolejka logów": self.duty_jobs.stats(),
+            "Limity służb": self.shift_deadlines.stats(),
+            "Pamięć podręczna": database.duty_cache.stats(),
+            "Bufor logów": database.audit_log.stats(),
+        }
+
+    @app_commands.command(name="pokaz_logi_sluzby", description="Pokazuje logi zdarzeń służby z podziałem na strony.")
+    @app_commands.describe(
+        limit="Liczba wpisów na stronę (1-25)",
+        uzytkownik="Pokaż tylko logi tej osoby",
+        akcja="Pokaż tylko akcje zawierające ten tekst",
+        od="Data początkowa w formacie DD/MM/RRRR",
+        do="Data końcowa (włącznie) w formacie DD/MM/RRRR"
+    )
+    @app_commands.checks.has_permissions(administrator=True)
+    async def show_duty_logs(self, interaction: discord.Interaction, limit: int = 10, uzytkownik: discord.User = None, akcja: str = None, od: str = None, do: str = None):
+        can_followup = await handle_interaction_error(interaction)
+        if not can_followup:
+            return
+
+        try:
+            since = self._parse_local_date(od) if od else None
+            until = self._parse_local_date(do) + datetime.timedelta(days=1) if do else None
+        except ValueError:
+            await interaction.followup.send("Niepoprawny format daty. Użyj DD/MM/RRRR.", ephemeral=True)
+            return
+
+        view = DutyLogsView(
+            self, interaction.user.id, interaction.guild.id,
+            page_size=max(1, min(limit, 25)),
+            user_id=uzytkownik.id if uzytkownik else None,
+            action=akcja, since=since, until=until
+        )
+        await view.load()
+        if not view.rows:
             await interaction.followup.send("Brak logów służby.", ephemeral=True)
             return
+        await interaction.followup.send(embed=view.build_embed(), view=view, ephemeral=True)
+
+    def _parse_local_date(self, value: str) -> datetime.datetime:
+        """Zamienia datę DD/MM/RRRR (czas polski, północ) na naiwny datetime UTC."""
+        local_date = datetime.datetime.strptime(value, "%d/%m/%Y")
+        return self.poland_tz.localize(local_date).astimezone(pytz.utc).replace(tzinfo=None)
+
+    def format_log_line(self, log_entry, names: dict) -> str:
+        timestamp = datetime.datetime.fromisoformat(log_entry['timestamp']).strftime("%Y-%m-%d %H:%M:%S")
+        username = names.get(log_entry['user_id'], f"ID: {log_entry['user_id']}")
+        action = log_entry['action']
+        details = f" ({log_entry['details']})" if log_entry['details'] else ""
+        return f"[{timestamp}] {username}: {action}{details}"[:150]
+
+class SummaryPageButton(discord.ui.DynamicItem[discord.ui.Button], template=r"summary_page:(?P<page>-?\d+)"):
+    """
+    Przycisk stronicowania panelu podsumowania. Docelowa strona jest w custom_id, więc
+    przycisk działa po restarcie, a każdy oglądający ma własną stronę: kliknięcie na
+    wspólnym panelu otwiera prywatną (efemeryczną) kopię, dalsze kliknięcia edytują tylko ją.
+    """
+
+    def __init__(self, page: int, label: str, disabled: bool = False):
+        super().__init__(discord.ui.Button(
+            label=label, style=discord.ButtonStyle.secondary, custom_id=f"summary_page:{page}", disabled=disabled
+        ))
+        self.page = page
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        return cls(int(match["page"]), item.label)
 
-        log_lines = []
-        for log_entry in logs:
-            timestamp = datetime.datetime.fromisoformat(log_entry['timestamp']).strftime("%Y-%m-%d %H:%M:%S")
-            user = self.bot.get_user(log_entry['user_id'])
-            username = user.display_name if user else f"ID: {log_entry['user_id']}"
-            action = log_entry['action']
-            details = f" ({log_entry['details']})" if log_entry['details'] else ""
-            log_lines.append(f"[{timestamp}] {username}: {action}{details}")
-        
-        log_message = "\n".join(log_lines)
-        if len(log_message) > 4000:
-             log_message = log_message[:3990] + "..."
+    async def callback(self, interaction: discord.Interaction):
+        cog = interaction.client.get_cog("zmiana")
+        embed, view = await cog.render_summary_page(interaction.guild, self.page)
+        if interaction.message.flags.ephemeral:
+            await interaction.response.edit_message(embed=embed, view=view)
+        else:
+            await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
+
+def summary_page_view(page: int, pages: int) -> discord.ui.View:
+    view = discord.ui.View(timeout=None)
+    view.add_item(SummaryPageButton(page - 1, "◀ Poprzednia", disabled=page <= 0))
+    view.add_item(SummaryPageButton(page + 1, "Następna ▶", disabled=page >= pages - 1))
+    return view
+
+class DutyLogsView(discord.ui.View):
+    """Stronicowany podgląd logów służby - kolejne strony pobierane kursorem z bazy."""
 
+    def __init__(self, cog_instance, owner_id: int, guild_id: int, page_size: int, **filters):
+        super().__init__(timeout=300)
+        self.cog = cog_instance
+        self.owner_id = owner_id
+        self.guild_id = guild_id
+        self.page_size = page_size
+        self.filters = filters
+        self.rows = []
+        self.names = {}
+        self.page = 1
+        self.has_newer = False
+        self.has_older = False
+
+    async def load(self, before=None, after=None):
+        rows, has_more = await database.aio.get_duty_logs_page(
+            self.guild_id, self.page_size, before=before, after=after, **self.filters
+        )
+        if after is not None:
+            self.has_newer, self.has_older = has_more, True
+        else:
+            self.has_newer, self.has_older = before is not None, has_more
+        self.rows = rows
+        guild = self.cog.bot.get_guild(self.guild_id)
+        if guild:
+            self.names = await self.cog.display_names(guild, [row['user_id'] for row in rows])
+        self.newer_button.disabled = not self.has_newer
+        self.older_button.disabled = not self.has_older
+
+    def build_embed(self) -> discord.Embed:
+        log_message = "\n".join(self.cog.format_log_line(row, self.names) for row in self.rows)
         embed = discord.Embed(title="Logi Służby", description=f"```\n{log_message}\n```", color=discord.Color.orange())
-        await interaction.followup.send(embed=embed, ephemeral=True)
+        embed.set_footer(text=f"Strona {self.page}")
+        return embed
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        return interaction.user.id == self.owner_id
+
+    @discord.ui.button(label="◀ Nowsze", style=discord.ButtonStyle.secondary)
+    async def newer_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        first = self.rows[0]
+        await self.load(after=(first['ts_epoch'], first['log_id']))
+        self.page = 1 if not self.has_newer else max(1, self.page - 1)
+        await interaction.response.edit_message(embed=self.build_embed(), view=self)
+
+    @discord.ui.button(label="Starsze ▶", style=discord.ButtonStyle.secondary)
+    async def older_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        last = self.rows[-1]
+        await self.load(before=(last['ts_epoch'], last['log_id']))
+        self.page += 1
+        await interaction.response.edit_message(embed=self.build_embed(), view=self)
 
 async def setup(bot: commands.Bot):
     await bot.add_cog(zmiana(bot))
\ No newline at end of file
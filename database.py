@@ -4,108 +4,738 @@ Moduł do obsługi bazy danych SQLite.
 import sqlite3
 import os
 import datetime
+import asyncio
+import functools
+import threading
+import types
+import inspect
+import collections
+import atexit
+import logging
+import pytz
+import csv
+import gzip
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger('bot')
 
 # Ścieżka do pliku bazy danych. Plik zostanie utworzony w tym samym folderze co bot.
 DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database.db')
 
-def get_db_connection():
-    """Nawiązuje połączenie z bazą danych i zwraca obiekt połączenia."""
-    conn = sqlite3.connect(DB_PATH)
+# Opcjonalny podział na osobne pliki per serwer (ustawiany przez configure(), w bocie
+# z DB_SHARD_DIR w .env). Każdy serwer ma wtedy własną bazę, więc blokada zapisu
+# na jednym serwerze nie wstrzymuje innych.
+SHARD_DIR = None
+
+# Strefa czasowa, w której liczone są granice dni, tygodni i miesięcy w raportach służby.
+ROLLUP_TZ = pytz.timezone('Europe/Warsaw')
+
+# Parametry trwałych połączeń. WAL pozwala czytelnikom działać równolegle z zapisem,
+# a synchronous=NORMAL w trybie WAL robi fsync tylko przy checkpoincie.
+READ_WORKERS = 4
+WRITE_WORKERS = 4
+SHARD_MAX_OPEN = 32
+CACHE_SIZE_KIB = 16384
+CACHED_STATEMENTS = 256
+BUSY_TIMEOUT = 30
+
+# Zapisy trafiają do wątku zapisującego (SQLite dopuszcza jednego pisarza na plik),
+# odczyty do puli wątków czytelników. Dzięki temu commit (fsync) nie blokuje pętli
+# zdarzeń, a odczyty nie czekają w kolejce za zapisami. Bez shardów wszystkie zapisy
+# idą do pierwszego wątku; z shardami serwer jest przypisany do stałego wątku, więc
+# zapisy różnych serwerów wykonują się równolegle.
+_local = threading.local()
+_connections = set()
+_connections_lock = threading.Lock()
+_connections_generation = 0
+_migrated_paths = set()
+
+def _mark_read_only():
+    _local.read_only = True
+
+def _mark_writer(index):
+    _local.writer_index = index
+
+_write_executors = [
+    ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"database-writer-{index}",
+                       initializer=_mark_writer, initargs=(index,))
+    for index in range(WRITE_WORKERS)
+]
+_read_executor = ThreadPoolExecutor(max_workers=READ_WORKERS, thread_name_prefix="database-reader",
+                                    initializer=_mark_read_only)
+
+def configure(db_path=None, shard_dir=None):
+    """
+    Zmienia lokalizację bazy (np. dla benchmarku lub narzędzi). `shard_dir` włącza
+    podział na pliki per serwer. Wywołać przed initialize_db(); zamyka otwarte połączenia.
+    """
+    global DB_PATH, SHARD_DIR
+    close_connections()
+    if db_path is not None:
+        DB_PATH = db_path
+    SHARD_DIR = shard_dir
+    duty_cache.invalidate()
+
+def _writer_index(guild_id):
+    if SHARD_DIR is None or guild_id is None:
+        return 0
+    return guild_id % WRITE_WORKERS
+
+def _guild_id_getter(func):
+    """Zwraca funkcję wyciągającą guild_id z argumentów wywołania `func` (lub None)."""
+    parameters = list(inspect.signature(func).parameters)
+    if 'guild_id' not in parameters:
+        return lambda args, kwargs: None
+    position = parameters.index('guild_id')
+    def getter(args, kwargs):
+        if 'guild_id' in kwargs:
+            return kwargs['guild_id']
+        return args[position] if position < len(args) else None
+    return getter
+
+# Asynchroniczne odpowiedniki funkcji modułu, np. `await database.aio.is_user_on_duty(...)`.
+# Synchroniczne funkcje pozostają dostępne jako warstwa zgodności.
+aio = types.SimpleNamespace()
+
+async def run_in_executor(func, *args, write=True, guild_id=None, **kwargs):
+    """Wykonuje funkcję bazy danych w wątku zapisującym serwera (lub w puli odczytów) i zwraca jej wynik."""
+    loop = asyncio.get_running_loop()
+    executor = _write_executors[_writer_index(guild_id)] if write else _read_executor
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+def _register_async(func, write):
+    get_guild_id = _guild_id_getter(func)
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_in_executor(func, *args, write=write, guild_id=get_guild_id(args, kwargs), **kwargs)
+    setattr(aio, func.__name__, wrapper)
+    return func
+
+def _read_api(func):
+    """Rejestruje w `aio` asynchroniczną wersję funkcji tylko czytającej."""
+    return _register_async(func, write=False)
+
+def _write_api(func):
+    """Rejestruje w `aio` asynchroniczną wersję funkcji zapisującej."""
+    return _register_async(func, write=True)
+
+def _memory_api(func):
+    """Rejestruje w `aio` wersję wykonywaną od razu w pętli zdarzeń - dla funkcji, które nie dotykają SQLite."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return func(*args, **kwargs)
+    setattr(aio, func.__name__, wrapper)
+    return func
+
+def _submit_to_writer(index, func, *args):
+    """
+    Zleca funkcję wątkowi zapisującemu `index`. Zwraca Future albo None, jeśli funkcja
+    została wykonana od razu (jesteśmy już w tym wątku lub wątki są zatrzymane).
+    """
+    if getattr(_local, "writer_index", None) == index:
+        func(*args)
+        return None
+    try:
+        return _write_executors[index].submit(func, *args)
+    except RuntimeError:
+        # Wątek zapisujący jest już zatrzymany (zamykanie procesu) - zapisz bezpośrednio.
+        func(*args)
+        return None
+
+def shard_path(guild_id):
+    return os.path.join(SHARD_DIR, f"guild_{guild_id}.db")
+
+def _shard_paths():
+    if not os.path.isdir(SHARD_DIR):
+        return []
+    return sorted(os.path.join(SHARD_DIR, name) for name in os.listdir(SHARD_DIR)
+                  if name.startswith("guild_") and name.endswith(".db"))
+
+def _open_connection(path, read_only=False):
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, cached_statements=CACHED_STATEMENTS,
+                           check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KIB}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    if read_only:
+        conn.execute("PRAGMA query_only=ON")
     return conn
 
+def _thread_connections():
+    """Połączenia bieżącego wątku (ścieżka -> połączenie) w kolejności ostatniego użycia."""
+    if getattr(_local, "generation", None) != _connections_generation:
+        _local.connections = collections.OrderedDict()
+        _local.generation = _connections_generation
+    return _local.connections
+
+def _connection_for_path(path):
+    connections = _thread_connections()
+    conn = connections.get(path)
+    if conn is not None:
+        connections.move_to_end(path)
+        return conn
+
+    if path not in _migrated_paths:
+        # Nowy plik (np. shard nowego serwera) - schemat zakładamy połączeniem do zapisu
+        migration_conn = _open_connection(path)
+        try:
+            apply_migrations(migration_conn)
+        finally:
+            migration_conn.close()
+        _migrated_paths.add(path)
+
+    conn = _open_connection(path, getattr(_local, "read_only", False))
+    connections[path] = conn
+    with _connections_lock:
+        _connections.add(conn)
+    # Shardy otwieramy leniwie i zamykamy najdawniej używane ponad limit
+    while len(connections) > SHARD_MAX_OPEN:
+        _, oldest = connections.popitem(last=False)
+        with _connections_lock:
+            _connections.discard(oldest)
+        oldest.close()
+    return conn
+
+def get_db_connection(guild_id=None):
+    """
+    Zwraca trwałe połączenie bieżącego wątku, otwierając je przy pierwszym użyciu.
+    Przy włączonych shardach połączenie dotyczy bazy danego serwera.
+    Połączenie nie jest zamykane po `with` - blok jedynie zatwierdza transakcję,
+    a przygotowane zapytania zostają w pamięci podręcznej połączenia.
+    """
+    if SHARD_DIR is not None and guild_id is not None:
+        return _connection_for_path(shard_path(guild_id))
+    return _connection_for_path(DB_PATH)
+
+def iter_db_connections():
+    """
+    Generator połączeń do wszystkich baz: głównej albo każdego istniejącego sharda.
+    Połączenie trzeba wykorzystać przed pobraniem następnego - przy ponad SHARD_MAX_OPEN
+    shardach otwarcie kolejnego zamyka najdawniej używane.
+    """
+    if SHARD_DIR is None:
+        yield get_db_connection()
+        return
+    for path in _shard_paths():
+        yield _connection_for_path(path)
+
+def close_connections():
+    """Zamyka wszystkie trwałe połączenia otwarte przez moduł."""
+    global _connections_generation
+    with _connections_lock:
+        for conn in _connections:
+            conn.close()
+        _connections.clear()
+        _connections_generation += 1
+    _migrated_paths.clear()
+
+def shutdown():
+    """Czeka na zakończenie zaległych operacji, zatrzymuje wątki bazy danych i zamyka połączenia."""
+    audit_log.close()
+    for executor in _write_executors:
+        executor.shutdown(wait=True)
+    _read_executor.shutdown(wait=True)
+    close_connections()
+
+# --- Migracje schematu ---
+#
+# Każda migracja to funkcja przyjmująca połączenie, wykonywana dokładnie raz w jednej
+# transakcji razem z podbiciem `PRAGMA user_version`. Aktualna baza przy starcie
+# wymaga więc tylko odczytu numeru wersji. Nowe zmiany schematu dopisujemy na końcu
+# listy MIGRATIONS - nigdy nie zmieniamy migracji, które zostały już wydane.
+
+def _table_columns(conn, table):
+    return {row['name'] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+def _add_column_if_missing(conn, table, column, definition):
+    if column not in _table_columns(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def _rebuild_table(conn, table, create_sql, column_exprs):
+    """
+    Przebudowuje tabelę (zmiana typów, ograniczeń, kolejności kolumn), czego SQLite
+    nie potrafi zrobić przez ALTER TABLE. `create_sql` tworzy nową tabelę pod nazwą
+    `{table}__new`, a `column_exprs` mapuje kolumny nowej tabeli na wyrażenia SQL
+    liczone ze starych wierszy (pozwala to od razu uzupełnić dane). Indeksy starej
+    tabeli znikają razem z nią - migracja musi utworzyć je ponownie.
+    """
+    conn.execute(f"DROP TABLE IF EXISTS {table}__new")
+    conn.execute(create_sql)
+    columns = ", ".join(column_exprs)
+    exprs = ", ".join(column_exprs.values())
+    conn.execute(f"INSERT INTO {table}__new ({columns}) SELECT {exprs} FROM {table}")
+    conn.execute(f"DROP TABLE {table}")
+    conn.execute(f"ALTER TABLE {table}__new RENAME TO {table}")
+
+def _migration_initial_schema(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS duty_panels (
+            guild_id INTEGER PRIMARY KEY,
+            channel_id INTEGER NOT NULL,
+            active_message_id INTEGER,
+            summary_message_id INTEGER,
+            log_channel_id INTEGER
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS active_duty_users (
+            user_id INTEGER NOT NULL,
+            guild_id INTEGER NOT NULL,
+            start_time TEXT NOT NULL,
+            log_message_id INTEGER,
+            PRIMARY KEY (user_id, guild_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_duty_stats (
+            user_id INTEGER NOT NULL,
+            guild_id INTEGER NOT NULL,
+            total_duty_seconds INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, guild_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS duty_logs (
+            log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            details TEXT
+        )
+    ''')
+    # Bazy sprzed wprowadzenia migracji mogą nie mieć tych kolumn
+    _add_column_if_missing(conn, 'duty_panels', 'log_channel_id', 'INTEGER')
+    _add_column_if_missing(conn, 'active_duty_users', 'log_message_id', 'INTEGER')
+
+def _migration_duty_logs_epoch(conn):
+    # Kolumna mogła zostać dodana wcześniej przez initialize_db sprzed migracji
+    _add_column_if_missing(conn, 'duty_logs', 'ts_epoch', 'INTEGER')
+    _rebuild_table(conn, 'duty_logs', '''
+        CREATE TABLE duty_logs__new (
+            log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            ts_epoch INTEGER NOT NULL,
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            details TEXT
+        )
+    ''', {
+        'log_id': 'log_id',
+        'timestamp': 'timestamp',
+        'ts_epoch': "COALESCE(ts_epoch, CAST(strftime('%s', timestamp) AS INTEGER))",
+        'guild_id': 'guild_id',
+        'user_id': 'user_id',
+        'action': 'action',
+        'details': 'details',
+    })
+    conn.execute("CREATE INDEX idx_duty_logs_guild_ts ON duty_logs (guild_id, ts_epoch, log_id)")
+    conn.execute("CREATE INDEX idx_duty_logs_guild_user_ts ON duty_logs (guild_id, user_id, ts_epoch, log_id)")
+
+def _migration_duty_sessions(conn):
+    conn.execute('''
+        CREATE TABLE duty_sessions (
+            session_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            start_epoch INTEGER NOT NULL,
+            end_epoch INTEGER NOT NULL,
+            duration_seconds INTEGER NOT NULL,
+            ended_by INTEGER
+        )
+    ''')
+    conn.execute("CREATE INDEX idx_duty_sessions_guild_user_start ON duty_sessions (guild_id, user_id, start_epoch)")
+    conn.execute('''
+        CREATE TABLE duty_rollups (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            period TEXT NOT NULL,
+            period_start TEXT NOT NULL,
+            seconds INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, user_id, period, period_start)
+        ) WITHOUT ROWID
+    ''')
+    # Odtworzenie historii z logów zejścia ze służby ("Czas trwania: Ns").
+    # Logika podziału na okresy jest tu skopiowana, żeby zmiany bieżących funkcji nie zmieniały tej migracji.
+    tz = pytz.timezone('Europe/Warsaw')
+    logs = conn.execute(
+        "SELECT guild_id, user_id, ts_epoch, details FROM duty_logs "
+        "WHERE action = 'Zszedł ze służby' AND details LIKE 'Czas trwania: %s' ORDER BY log_id"
+    ).fetchall()
+    sessions = []
+    rollups = {}
+    for row in logs:
+        try:
+            duration = max(0, int(row['details'][len('Czas trwania: '):-1]))
+        except ValueError:
+            continue
+        start_epoch, end_epoch = row['ts_epoch'] - duration, row['ts_epoch']
+        sessions.append((row['guild_id'], row['user_id'], start_epoch, end_epoch, duration))
+        current = datetime.datetime.fromtimestamp(start_epoch, tz)
+        end = datetime.datetime.fromtimestamp(end_epoch, tz)
+        while current < end:
+            next_midnight = tz.localize(datetime.datetime.combine(current.date() + datetime.timedelta(days=1), datetime.time()))
+            segment_end = min(end, next_midnight)
+            day = current.date()
+            for period, period_start in (('day', day), ('week', day - datetime.timedelta(days=day.weekday())), ('month', day.replace(day=1))):
+                key = (row['guild_id'], row['user_id'], period, period_start.isoformat())
+                rollups[key] = rollups.get(key, 0) + int((segment_end - current).total_seconds())
+            current = segment_end
+    conn.executemany(
+        "INSERT INTO duty_sessions (guild_id, user_id, start_epoch, end_epoch, duration_seconds) VALUES (?, ?, ?, ?, ?)",
+        sessions
+    )
+    conn.executemany(
+        "INSERT INTO duty_rollups (guild_id, user_id, period, period_start, seconds) VALUES (?, ?, ?, ?, ?)",
+        [key + (seconds,) for key, seconds in rollups.items()]
+    )
+
+def _migration_duty_stats_ranking(conn):
+    conn.execute("CREATE INDEX idx_user_duty_stats_guild_total ON user_duty_stats (guild_id, total_duty_seconds DESC, user_id)")
+
+def _migration_user_names(conn):
+    # Nazwy wyświetlane zapisywane przy interakcjach - panele nie potrzebują pamięci członków serwera
+    conn.execute('''
+        CREATE TABLE user_names (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            display_name TEXT NOT NULL,
+            updated_at INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, user_id)
+        )
+    ''')
+
+def _migration_panel_relative_timestamps(conn):
+    _add_column_if_missing(conn, 'duty_panels', 'relative_timestamps', 'INTEGER NOT NULL DEFAULT 0')
+
+def _migration_panel_max_shift(conn):
+    # Limit długości służby (minuty); NULL = bez automatycznego zamykania
+    _add_column_if_missing(conn, 'duty_panels', 'max_shift_minutes', 'INTEGER')
+
+def _migration_tickets(conn):
+    conn.execute('''
+        CREATE TABLE tickets (
+            channel_id INTEGER PRIMARY KEY,
+            guild_id INTEGER NOT NULL,
+            creator_id INTEGER NOT NULL,
+            ticket_type TEXT NOT NULL,
+            claimed_by INTEGER,
+            created_at INTEGER NOT NULL,
+            claimed_at INTEGER,
+            closed_at INTEGER
+        )
+    ''')
+
+def _migration_ticket_panels(conn):
+    conn.execute('''
+        CREATE TABLE ticket_panels (
+            guild_id INTEGER PRIMARY KEY,
+            channel_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL
+        )
+    ''')
+
+def _migration_tickets_open_index(conn):
+    conn.execute("CREATE INDEX idx_tickets_open_by_creator ON tickets (guild_id, creator_id) WHERE closed_at IS NULL")
+
+MIGRATIONS = [
+    (1, _migration_initial_schema),
+    (2, _migration_duty_logs_epoch),
+    (3, _migration_duty_sessions),
+    (4, _migration_duty_stats_ranking),
+    (5, _migration_user_names),
+    (6, _migration_panel_relative_timestamps),
+    (7, _migration_panel_max_shift),
+    (8, _migration_tickets),
+    (9, _migration_ticket_panels),
+    (10, _migration_tickets_open_index),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def apply_migrations(conn):
+    """Doprowadza schemat bazy do SCHEMA_VERSION. Zwraca liczbę wykonanych migracji."""
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        return 0
+    applied = 0
+    for version, migration in MIGRATIONS:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Wersję sprawdzamy ponownie pod blokadą zapisu - inny proces mógł nas wyprzedzić
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+                conn.rollback()
+                continue
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied += 1
+        print(f"Zastosowano migrację bazy danych {version}: {migration.__name__}")
+    return applied
+
 def initialize_db():
     """
-    Inicjalizuje bazę danych, tworząc tabele, jeśli nie istnieją,
-    i dodając nowe kolumny w razie potrzeby.
-    """
-    print("Sprawdzanie i inicjalizowanie bazy danych...")
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS duty_panels (
-                guild_id INTEGER PRIMARY KEY,
-                channel_id INTEGER NOT NULL,
-                active_message_id INTEGER,
-                summary_message_id INTEGER,
-                log_channel_id INTEGER
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS active_duty_users (
-                user_id INTEGER NOT NULL,
-                guild_id INTEGER NOT NULL,
-                start_time TEXT NOT NULL,
-                log_message_id INTEGER,
-                PRIMARY KEY (user_id, guild_id)
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_duty_stats (
-                user_id INTEGER NOT NULL,
-                guild_id INTEGER NOT NULL,
-                total_duty_seconds INTEGER DEFAULT 0,
-                PRIMARY KEY (user_id, guild_id)
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS duty_logs (
-                log_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT NOT NULL,
-                guild_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                action TEXT NOT NULL,
-                details TEXT
-            )
-        ''')
-
-        # Sprawdzenie i dodanie kolumn, jeśli nie istnieją
-        for table, column, type in [('duty_panels', 'log_channel_id', 'INTEGER'), 
-                                     ('active_duty_users', 'log_message_id', 'INTEGER')]:
-            try:
-                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {type}")
-            except sqlite3.OperationalError as e:
-                if "duplicate column name" not in str(e):
-                    raise
-        
-        conn.commit()
-    print("Baza danych jest gotowa.")
+    Inicjalizuje bazę danych, wykonując zaległe migracje schematu (przy shardach -
+    w każdym istniejącym pliku; nowe shardy są migrowane przy pierwszym otwarciu).
+    """
+    if SHARD_DIR is not None:
+        os.makedirs(SHARD_DIR, exist_ok=True)
+    # Otwarcie połączenia wykonuje zaległe migracje danego pliku
+    for _ in iter_db_connections():
+        pass
+    warm_duty_cache()
+
+def _epoch(value):
+    """Zamienia datetime (naiwny = UTC) na liczbę sekund epoki."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return int(value.timestamp())
+
+# --- Pamięć podręczna stanu służby ---
+#
+# Tabele duty_panels i active_duty_users zapisuje wyłącznie bot, więc trzymamy ich
+# kopię w pamięci (per serwer). Kopia jest ładowana przy starcie i aktualizowana po
+# każdym zapisie (write-through), a odczyty z załadowanego serwera nie dotykają SQLite.
+
+class DutyStateCache:
+    """Kopia duty_panels i active_duty_users w pamięci, z licznikami trafień."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._panels = {}
+        self._active = {}
+        self._loaded_guilds = set()
+        self._all_loaded = False
+        self.hits = 0
+        self.misses = 0
+
+    def is_loaded(self, guild_id):
+        return self._all_loaded or guild_id in self._loaded_guilds
+
+    def is_fully_loaded(self):
+        return self._all_loaded
+
+    def load_all(self, connections):
+        """Wczytuje stan wszystkich serwerów (wywoływane przy starcie)."""
+        panels = {}
+        active = {}
+        for conn in connections:
+            panels.update((row['guild_id'], dict(row)) for row in conn.execute("SELECT * FROM duty_panels"))
+            for row in conn.execute("SELECT * FROM active_duty_users"):
+                active.setdefault(row['guild_id'], {})[row['user_id']] = dict(row)
+        with self._lock:
+            self._panels = panels
+            self._active = active
+            self._all_loaded = True
+
+    def _ensure_loaded(self, guild_id):
+        with self._lock:
+            if self.is_loaded(guild_id):
+                self.hits += 1
+                return
+            self.misses += 1
+        conn = get_db_connection(guild_id)
+        panel = conn.execute("SELECT * FROM duty_panels WHERE guild_id = ?", (guild_id,)).fetchone()
+        active = {row['user_id']: dict(row) for row in conn.execute("SELECT * FROM active_duty_users WHERE guild_id = ?", (guild_id,))}
+        with self._lock:
+            if not self.is_loaded(guild_id):
+                if panel is not None:
+                    self._panels[guild_id] = dict(panel)
+                self._active[guild_id] = active
+                self._loaded_guilds.add(guild_id)
+
+    def invalidate(self, guild_id=None):
+        """Usuwa serwer (lub wszystko) z pamięci - kolejny odczyt wczyta go z bazy."""
+        with self._lock:
+            if guild_id is None:
+                self._panels.clear()
+                self._active.clear()
+                self._loaded_guilds.clear()
+                self._all_loaded = False
+            else:
+                self._panels.pop(guild_id, None)
+                self._active.pop(guild_id, None)
+                self._loaded_guilds.discard(guild_id)
+                if self._all_loaded:
+                    # Pozostałe serwery zostają załadowane, ten jeden trzeba wczytać ponownie
+                    self._loaded_guilds.update(self._active.keys() | self._panels.keys())
+                    self._all_loaded = False
+
+    def panel(self, guild_id):
+        self._ensure_loaded(guild_id)
+        return self._panels.get(guild_id)
+
+    def all_panels(self):
+        with self._lock:
+            return list(self._panels.values())
+
+    def active_entry(self, user_id, guild_id):
+        self._ensure_loaded(guild_id)
+        return self._active.get(guild_id, {}).get(user_id)
+
+    def active_entries(self, guild_id):
+        self._ensure_loaded(guild_id)
+        return list(self._active.get(guild_id, {}).values())
+
+    def refresh_panel(self, conn, guild_id):
+        """Aktualizuje kopię panelu po zapisie (wywoływane w wątku zapisującym)."""
+        with self._lock:
+            if not self.is_loaded(guild_id):
+                return
+        row = conn.execute("SELECT * FROM duty_panels WHERE guild_id = ?", (guild_id,)).fetchone()
+        with self._lock:
+            if row is None:
+                self._panels.pop(guild_id, None)
+            else:
+                self._panels[guild_id] = dict(row)
+
+    def refresh_active(self, conn, user_id, guild_id):
+        """Aktualizuje kopię wpisu aktywnej służby po zapisie."""
+        with self._lock:
+            if not self.is_loaded(guild_id):
+                return
+        row = conn.execute("SELECT * FROM active_duty_users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)).fetchone()
+        with self._lock:
+            guild_active = self._active.setdefault(guild_id, {})
+            if row is None:
+                guild_active.pop(user_id, None)
+            else:
+                guild_active[user_id] = dict(row)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "guilds": len(self._active.keys() | self._panels.keys()),
+                "active_users": sum(len(users) for users in self._active.values()),
+            }
+
+    def verify(self, connections):
+        """Porównuje kopię w pamięci z bazą. Zwraca listę wykrytych rozbieżności."""
+        problems = []
+        db_panels = {}
+        db_active = {}
+        for conn in connections:
+            db_panels.update((row['guild_id'], dict(row)) for row in conn.execute("SELECT * FROM duty_panels"))
+            db_active.update(((row['guild_id'], row['user_id']), dict(row)) for row in conn.execute("SELECT * FROM active_duty_users"))
+        with self._lock:
+            cached_panels = {guild_id: panel for guild_id, panel in self._panels.items()}
+            cached_active = {(guild_id, user_id): entry
+                             for guild_id, users in self._active.items() for user_id, entry in users.items()}
+            loaded = self.is_loaded
+            for guild_id in db_panels.keys() | cached_panels.keys():
+                if loaded(guild_id) and db_panels.get(guild_id) != cached_panels.get(guild_id):
+                    problems.append(f"duty_panels[{guild_id}]: pamięć={cached_panels.get(guild_id)} baza={db_panels.get(guild_id)}")
+            for key in db_active.keys() | cached_active.keys():
+                if loaded(key[0]) and db_active.get(key) != cached_active.get(key):
+                    problems.append(f"active_duty_users[{key}]: pamięć={cached_active.get(key)} baza={db_active.get(key)}")
+        return problems
+
+duty_cache = DutyStateCache()
+
+def _cached_api(is_cached):
+    """
+    Rejestruje w `aio` wersję funkcji, która przy trafieniu w pamięć podręczną
+    (`is_cached(*args)`) wykonuje się od razu w pętli zdarzeń, a w przeciwnym razie
+    w puli odczytów.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if is_cached(*args, **kwargs):
+                return func(*args, **kwargs)
+            return await run_in_executor(func, *args, write=False, **kwargs)
+        setattr(aio, func.__name__, wrapper)
+        return func
+    return decorator
+
+def _guild_cached(*args, **kwargs):
+    guild_id = kwargs['guild_id'] if 'guild_id' in kwargs else args[-1]
+    return duty_cache.is_loaded(guild_id)
+
+def warm_duty_cache():
+    """Wczytuje do pamięci panele i aktywne służby wszystkich serwerów."""
+    duty_cache.load_all(iter_db_connections())
+
+@_read_api
+def verify_duty_cache():
+    """Zwraca listę rozbieżności między pamięcią podręczną a bazą (pusta = zgodne)."""
+    return duty_cache.verify(iter_db_connections())
+
+@_memory_api
+def get_duty_cache_stats():
+    return duty_cache.stats()
 
 # --- Funkcje panelu służby ---
 
+@_write_api
 def set_duty_panel(guild_id, channel_id, active_message_id, summary_message_id):
-    with get_db_connection() as conn:
+    with get_db_connection(guild_id) as conn:
         conn.execute(
             "INSERT INTO duty_panels (guild_id, channel_id, active_message_id, summary_message_id) VALUES (?, ?, ?, ?) "
             "ON CONFLICT(guild_id) DO UPDATE SET channel_id = ?, active_message_id = ?, summary_message_id = ?",
             (guild_id, channel_id, active_message_id, summary_message_id, channel_id, active_message_id, summary_message_id)
         )
+    duty_cache.refresh_panel(conn, guild_id)
 
+@_write_api
+def set_duty_panel_message(guild_id, column, message_id):
+    """Podmienia zapisane ID wiadomości panelu (`active_message_id` lub `summary_message_id`)."""
+    if column not in ('active_message_id', 'summary_message_id'):
+        raise ValueError(column)
+    with get_db_connection(guild_id) as conn:
+        conn.execute(f"UPDATE duty_panels SET {column} = ? WHERE guild_id = ?", (message_id, guild_id))
+    duty_cache.refresh_panel(conn, guild_id)
+
+@_write_api
 def set_duty_log_channel(guild_id, log_channel_id):
-    with get_db_connection() as conn:
+    with get_db_connection(guild_id) as conn:
         conn.execute("INSERT OR IGNORE INTO duty_panels (guild_id, channel_id) VALUES (?, 0)", (guild_id,))
         conn.execute("UPDATE duty_panels SET log_channel_id = ? WHERE guild_id = ?", (log_channel_id, guild_id))
+    duty_cache.refresh_panel(conn, guild_id)
+
+@_write_api
+def set_duty_panel_relative_timestamps(guild_id, enabled):
+    """Włącza/wyłącza tryb panelu aktywnych z czasem względnym <t:...:R> (bez okresowych edycji)."""
+    with get_db_connection(guild_id) as conn:
+        conn.execute("UPDATE duty_panels SET relative_timestamps = ? WHERE guild_id = ?", (int(enabled), guild_id))
+    duty_cache.refresh_panel(conn, guild_id)
+
+@_write_api
+def set_duty_panel_max_shift(guild_id, minutes):
+    """Ustawia limit długości służby w minutach (None wyłącza automatyczne zamykanie)."""
+    with get_db_connection(guild_id) as conn:
+        conn.execute("UPDATE duty_panels SET max_shift_minutes = ? WHERE guild_id = ?", (minutes, guild_id))
+    duty_cache.refresh_panel(conn, guild_id)
 
+@_cached_api(_guild_cached)
 def get_duty_panel(guild_id):
-    with get_db_connection() as conn:
-        return conn.execute("SELECT * FROM duty_panels WHERE guild_id = ?", (guild_id,)).fetchone()
+    return duty_cache.panel(guild_id)
 
+@_cached_api(lambda: duty_cache.is_fully_loaded())
 def get_all_duty_panels():
-    with get_db_connection() as conn:
-        return conn.execute("SELECT * FROM duty_panels").fetchall()
+    if duty_cache.is_fully_loaded():
+        return duty_cache.all_panels()
+    panels = []
+    for conn in iter_db_connections():
+        panels.extend(conn.execute("SELECT * FROM duty_panels").fetchall())
+    return panels
 
 # --- Funkcje aktywnych użytkowników ---
 
+@_cached_api(_guild_cached)
 def is_user_on_duty(user_id, guild_id):
-    with get_db_connection() as conn:
-        return conn.execute("SELECT 1 FROM active_duty_users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)).fetchone() is not None
+    return duty_cache.active_entry(user_id, guild_id) is not None
 
+@_write_api
 def add_user_to_duty(user_id, guild_id, start_time, log_message_id):
-    with get_db_connection() as conn:
+    with get_db_connection(guild_id) as conn:
         # Najpierw usuń istniejący wpis, aby uniknąć konfliktów
         conn.execute("DELETE FROM active_duty_users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id))
         # Następnie dodaj nowy, czysty wpis
@@ -113,64 +743,635 @@ def add_user_to_duty(user_id, guild_id, start_time, log_message_id):
             "INSERT INTO active_duty_users (user_id, guild_id, start_time, log_message_id) VALUES (?, ?, ?, ?)",
             (user_id, guild_id, start_time.isoformat(), log_message_id)
         )
+    duty_cache.refresh_active(conn, user_id, guild_id)
 
+@_cached_api(_guild_cached)
 def get_user_duty_entry(user_id, guild_id):
     """Pobiera konkretny wpis aktywnej służby dla użytkownika."""
-    with get_db_connection() as conn:
-        return conn.execute("SELECT * FROM active_duty_users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)).fetchone()
+    return duty_cache.active_entry(user_id, guild_id)
 
+@_write_api
 def remove_user_from_duty(user_id, guild_id):
-    with get_db_connection() as conn:
+    with get_db_connection(guild_id) as conn:
         conn.execute("DELETE FROM active_duty_users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id))
+    duty_cache.refresh_active(conn, user_id, guild_id)
 
+@_cached_api(_guild_cached)
 def get_on_duty_users(guild_id):
-    with get_db_connection() as conn:
-        return conn.execute("SELECT * FROM active_duty_users WHERE guild_id = ?", (guild_id,)).fetchall()
+    return duty_cache.active_entries(guild_id)
+
+# --- Złożone przejścia stanu służby ---
+#
+# Wejście i zejście ze służby to kilka zapisów (wpis aktywnej służby, suma godzin,
+# historia, log), które muszą zajść razem. Każde przejście wykonuje się w jednej
+# transakcji BEGIN IMMEDIATE, więc podwójne kliknięcie lub awaria w połowie nie
+# może naliczyć czasu dwukrotnie, a całość kosztuje jeden commit.
+
+_INSERT_DUTY_LOG = "INSERT INTO duty_logs (timestamp, ts_epoch, guild_id, user_id, action, details) VALUES (?, ?, ?, ?, ?, ?)"
+
+@_write_api
+def start_duty(user_id, guild_id, start_time, log_message_id=None, action="Wszedł na służbę"):
+    """Rozpoczyna służbę. Zwraca False, jeśli użytkownik już jest na służbie."""
+    with get_db_connection(guild_id) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        cursor = conn.execute(
+            "INSERT INTO active_duty_users (user_id, guild_id, start_time, log_message_id) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(user_id, guild_id) DO NOTHING",
+            (user_id, guild_id, start_time.isoformat(), log_message_id)
+        )
+        started = cursor.rowcount == 1
+        if started:
+            conn.execute(_INSERT_DUTY_LOG, (start_time.isoformat(), _epoch(start_time), guild_id, user_id, action, None))
+    if started:
+        duty_cache.refresh_active(conn, user_id, guild_id)
+    return started
+
+@_write_api
+def set_active_log_message(user_id, guild_id, start_time, log_message_id):
+    """
+    Zapisuje ID wiadomości logu wejścia, jeśli ta sama służba (ten sam start) wciąż trwa.
+    Zwraca True, gdy wpis został zaktualizowany.
+    """
+    with get_db_connection(guild_id) as conn:
+        updated = conn.execute(
+            "UPDATE active_duty_users SET log_message_id = ? WHERE user_id = ? AND guild_id = ? AND start_time = ?",
+            (log_message_id, user_id, guild_id, start_time.isoformat())
+        ).rowcount == 1
+    if updated:
+        duty_cache.refresh_active(conn, user_id, guild_id)
+    return updated
+
+@_write_api
+def end_duty(user_id, guild_id, end_time, action="Zszedł ze służby", details=None, ended_by=None):
+    """
+    Kończy służbę: dolicza czas do sumy, usuwa wpis aktywnej służby, zapisuje historię
+    i log. Zwraca słownik z danymi zakończonej służby (start_time, log_message_id,
+    duration_seconds, total_duty_seconds) albo None, jeśli użytkownik nie był na służbie.
+    """
+    with get_db_connection(guild_id) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        entry = conn.execute("SELECT * FROM active_duty_users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)).fetchone()
+        if entry is None:
+            return None
+        session = _close_duty(conn, entry, end_time, action, details, ended_by)
+    duty_cache.refresh_active(conn, user_id, guild_id)
+    return session
+
+@_write_api
+def end_expired_duties(guild_id, shifts, action="Automatycznie zakończono służbę"):
+    """
+    Zamyka wiele służb jednego serwera w jednej transakcji (np. po przekroczeniu limitu).
+    `shifts`: lista (user_id, start_time, end_time) - służba jest zamykana tylko wtedy,
+    gdy wciąż trwa ta sama (ten sam start). Zwraca {user_id: dane służby jak w end_duty}.
+    """
+    sessions = {}
+    with get_db_connection(guild_id) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        for user_id, start_time, end_time in shifts:
+            entry = conn.execute(
+                "SELECT * FROM active_duty_users WHERE user_id = ? AND guild_id = ? AND start_time = ?",
+                (user_id, guild_id, start_time.isoformat())
+            ).fetchone()
+            if entry is not None:
+                sessions[user_id] = _close_duty(conn, entry, end_time, action, None, None)
+    for user_id in sessions:
+        duty_cache.refresh_active(conn, user_id, guild_id)
+    return sessions
+
+def _close_duty(conn, entry, end_time, action, details, ended_by):
+    """Zapisy zakończenia służby w otwartej transakcji (suma, historia, log, usunięcie wpisu)."""
+    user_id, guild_id = entry['user_id'], entry['guild_id']
+    start_time = datetime.datetime.fromisoformat(entry['start_time'])
+    duration = max(0, int((end_time - start_time).total_seconds()))
+    conn.execute(
+        "INSERT INTO user_duty_stats (user_id, guild_id, total_duty_seconds) VALUES (?, ?, ?) "
+        "ON CONFLICT(user_id, guild_id) DO UPDATE SET total_duty_seconds = total_duty_seconds + excluded.total_duty_seconds",
+        (user_id, guild_id, duration)
+    )
+    conn.execute("DELETE FROM active_duty_users WHERE user_id = ? AND guild_id = ?", (user_id, guild_id))
+    _insert_duty_session(conn, guild_id, user_id, _epoch(start_time), _epoch(start_time) + duration, ended_by)
+    if details is None:
+        details = f"Czas trwania: {duration}s"
+    conn.execute(_INSERT_DUTY_LOG, (end_time.isoformat(), _epoch(end_time), guild_id, user_id, action, details))
+    total = conn.execute("SELECT total_duty_seconds FROM user_duty_stats WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)).fetchone()[0]
+    return {
+        'start_time': start_time,
+        'end_time': end_time,
+        'log_message_id': entry['log_message_id'],
+        'duration_seconds': duration,
+        'total_duty_seconds': total,
+    }
 
 # --- Funkcje statystyk służby ---
 
+@_write_api
 def adjust_user_total_duty_seconds(user_id, guild_id, seconds_delta):
-    with get_db_connection() as conn:
+    with get_db_connection(guild_id) as conn:
         conn.execute(
             "INSERT INTO user_duty_stats (user_id, guild_id, total_duty_seconds) VALUES (?, ?, ?) "
             "ON CONFLICT(user_id, guild_id) DO UPDATE SET total_duty_seconds = MAX(0, total_duty_seconds + ?)",
             (user_id, guild_id, max(0, seconds_delta), seconds_delta)
         )
 
+@_read_api
 def get_user_total_duty_seconds(user_id, guild_id):
-    with get_db_connection() as conn:
+    with get_db_connection(guild_id) as conn:
         result = conn.execute("SELECT total_duty_seconds FROM user_duty_stats WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)).fetchone()
     return result['total_duty_seconds'] if result else 0
 
+@_read_api
 def get_all_total_duty_seconds(guild_id):
-    with get_db_connection() as conn:
+    with get_db_connection(guild_id) as conn:
         return conn.execute("SELECT user_id, total_duty_seconds FROM user_duty_stats WHERE guild_id = ? ORDER BY total_duty_seconds DESC", (guild_id,)).fetchall()
 
+@_read_api
+def get_top_duty_users(guild_id, limit=25, offset=0):
+    """Zwraca fragment rankingu godzin (malejąco), czytany z indeksu bez sortowania całej tabeli."""
+    with get_db_connection(guild_id) as conn:
+        return conn.execute(
+            "SELECT user_id, total_duty_seconds FROM user_duty_stats WHERE guild_id = ? "
+            "ORDER BY total_duty_seconds DESC, user_id LIMIT ? OFFSET ?",
+            (guild_id, limit, offset)
+        ).fetchall()
+
+@_read_api
+def get_user_duty_rank(user_id, guild_id):
+    """Zwraca (miejsce w rankingu, suma sekund) użytkownika albo None, jeśli nie ma statystyk."""
+    with get_db_connection(guild_id) as conn:
+        row = conn.execute("SELECT total_duty_seconds FROM user_duty_stats WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)).fetchone()
+        if row is None:
+            return None
+        total = row['total_duty_seconds']
+        ahead = conn.execute(
+            "SELECT COUNT(*) FROM user_duty_stats WHERE guild_id = ? "
+            "AND (total_duty_seconds > ? OR (total_duty_seconds = ? AND user_id < ?))",
+            (guild_id, total, total, user_id)
+        ).fetchone()[0]
+    return ahead + 1, total
+
+@_write_api
+def set_user_names(guild_id, names):
+    """Zapisuje nazwy wyświetlane [(user_id, nazwa), ...]; niezmienione wiersze nie są nadpisywane."""
+    now = _epoch(datetime.datetime.utcnow())
+    with get_db_connection(guild_id) as conn:
+        conn.executemany(
+            "INSERT INTO user_names (guild_id, user_id, display_name, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(guild_id, user_id) DO UPDATE SET display_name = excluded.display_name, updated_at = excluded.updated_at "
+            "WHERE display_name != excluded.display_name",
+            [(guild_id, user_id, name, now) for user_id, name in names]
+        )
+
+@_read_api
+def get_user_names(guild_id, user_ids):
+    """Zwraca {user_id: nazwa} dla zapisanych użytkowników z listy."""
+    user_ids = list(set(user_ids))
+    if not user_ids:
+        return {}
+    names = {}
+    with get_db_connection(guild_id) as conn:
+        # Partiami, żeby nie przekroczyć limitu parametrów SQLite
+        for i in range(0, len(user_ids), 500):
+            chunk = user_ids[i:i + 500]
+            rows = conn.execute(
+                f"SELECT user_id, display_name FROM user_names WHERE guild_id = ? AND user_id IN ({', '.join('?' * len(chunk))})",
+                (guild_id, *chunk)
+            ).fetchall()
+            names.update((row['user_id'], row['display_name']) for row in rows)
+    return names
+
+@_read_api
+def count_duty_users(guild_id):
+    """Liczba użytkowników w rankingu godzin (do stronicowania panelu podsumowania)."""
+    with get_db_connection(guild_id) as conn:
+        return conn.execute("SELECT COUNT(*) FROM user_duty_stats WHERE guild_id = ?", (guild_id,)).fetchone()[0]
+
+@_write_api
 def reset_all_total_duty_seconds(guild_id):
-    with get_db_connection() as conn:
+    with get_db_connection(guild_id) as conn:
         conn.execute("UPDATE user_duty_stats SET total_duty_seconds = 0 WHERE guild_id = ?", (guild_id,))
 
+@_write_api
 def set_user_total_duty_seconds(user_id, guild_id, seconds):
-    with get_db_connection() as conn:
+    with get_db_connection(guild_id) as conn:
         conn.execute(
             "INSERT INTO user_duty_stats (user_id, guild_id, total_duty_seconds) VALUES (?, ?, ?) "
             "ON CONFLICT(user_id, guild_id) DO UPDATE SET total_duty_seconds = ?",
             (user_id, guild_id, seconds, seconds)
         )
 
+@_write_api
 def reset_user_total_duty_seconds(user_id, guild_id):
-    with get_db_connection() as conn:
+    with get_db_connection(guild_id) as conn:
         conn.execute("UPDATE user_duty_stats SET total_duty_seconds = 0 WHERE user_id = ? AND guild_id = ?", (user_id, guild_id))
 
+@_write_api
+def bulk_update_duty_seconds(guild_id, mode, seconds, actor_id, action, targets):
+    """
+    Zmienia godziny wielu osób naraz: jedna transakcja i jeden wsadowy zapis logu.
+    `mode`: 'set' (ustaw), 'add' (dodaj, ujemne odejmuje) lub 'reset' (zeruje istniejące).
+    `targets`: lista (user_id, opis do logu). Zwraca liczbę zmienionych wierszy.
+    """
+    if mode == 'set':
+        sql = ("INSERT INTO user_duty_stats (user_id, guild_id, total_duty_seconds) VALUES (?, ?, ?) "
+               "ON CONFLICT(user_id, guild_id) DO UPDATE SET total_duty_seconds = excluded.total_duty_seconds")
+        params = [(user_id, guild_id, seconds) for user_id, _ in targets]
+    elif mode == 'add':
+        sql = ("INSERT INTO user_duty_stats (user_id, guild_id, total_duty_seconds) VALUES (?, ?, ?) "
+               "ON CONFLICT(user_id, guild_id) DO UPDATE SET total_duty_seconds = MAX(0, total_duty_seconds + ?)")
+        params = [(user_id, guild_id, max(0, seconds), seconds) for user_id, _ in targets]
+    elif mode == 'reset':
+        sql = "UPDATE user_duty_stats SET total_duty_seconds = 0 WHERE user_id = ? AND guild_id = ?"
+        params = [(user_id, guild_id) for user_id, _ in targets]
+    else:
+        raise ValueError(mode)
+    now = datetime.datetime.utcnow()
+    with get_db_connection(guild_id) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        changed = conn.executemany(sql, params).rowcount
+        conn.executemany(_INSERT_DUTY_LOG, [
+            (now.isoformat(), _epoch(now), guild_id, actor_id, action, details) for _, details in targets
+        ])
+    return changed
+
+# --- Historia służb i podsumowania okresowe ---
+#
+# Każda zakończona służba trafia do duty_sessions, a jej czas jest od razu doliczany
+# do duty_rollups w kubełkach dziennych, tygodniowych i miesięcznych (czas polski).
+# Raport za dowolny okres to więc odczyt jednego wiersza po kluczu głównym.
+
+ROLLUP_PERIODS = ('day', 'week', 'month')
+
+def _period_starts(local_date):
+    """Zwraca początki okresów (dzień, tydzień od poniedziałku, miesiąc) zawierających datę."""
+    return {
+        'day': local_date,
+        'week': local_date - datetime.timedelta(days=local_date.weekday()),
+        'month': local_date.replace(day=1),
+    }
+
+def _previous_period_start(period, start):
+    if period == 'day':
+        return start - datetime.timedelta(days=1)
+    if period == 'week':
+        return start - datetime.timedelta(weeks=1)
+    return (start - datetime.timedelta(days=1)).replace(day=1)
+
+def _split_by_local_day(start_epoch, end_epoch):
+    """Dzieli przedział czasu na kawałki mieszczące się w pojedynczych dniach czasu lokalnego."""
+    current = datetime.datetime.fromtimestamp(start_epoch, ROLLUP_TZ)
+    end = datetime.datetime.fromtimestamp(end_epoch, ROLLUP_TZ)
+    while current < end:
+        next_midnight = ROLLUP_TZ.localize(
+            datetime.datetime.combine(current.date() + datetime.timedelta(days=1), datetime.time())
+        )
+        segment_end = min(end, next_midnight)
+        yield current.date(), int((segment_end - current).total_seconds())
+        current = segment_end
+
+def _insert_duty_session(conn, guild_id, user_id, start_epoch, end_epoch, ended_by=None):
+    """Zapisuje zakończoną służbę i dolicza ją do podsumowań (w transakcji wywołującego)."""
+    duration = max(0, end_epoch - start_epoch)
+    conn.execute(
+        "INSERT INTO duty_sessions (guild_id, user_id, start_epoch, end_epoch, duration_seconds, ended_by) VALUES (?, ?, ?, ?, ?, ?)",
+        (guild_id, user_id, start_epoch, end_epoch, duration, ended_by)
+    )
+    buckets = {}
+    for local_date, seconds in _split_by_local_day(start_epoch, end_epoch):
+        for period, period_start in _period_starts(local_date).items():
+            key = (period, period_start.isoformat())
+            buckets[key] = buckets.get(key, 0) + seconds
+    conn.executemany(
+        "INSERT INTO duty_rollups (guild_id, user_id, period, period_start, seconds) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT(guild_id, user_id, period, period_start) DO UPDATE SET seconds = seconds + excluded.seconds",
+        [(guild_id, user_id, period, period_start, seconds) for (period, period_start), seconds in buckets.items()]
+    )
+    return duration
+
+@_read_api
+def get_duty_report(guild_id, user_id, now=None):
+    """
+    Zwraca sekundy służby użytkownika w bieżącym i poprzednim dniu, tygodniu i miesiącu:
+    {('day', 'current'): ..., ('day', 'previous'): ..., ...}.
+    """
+    local_date = (now or datetime.datetime.now(ROLLUP_TZ)).astimezone(ROLLUP_TZ).date()
+    keys = {}
+    for period, start in _period_starts(local_date).items():
+        keys[(period, start.isoformat())] = (period, 'current')
+        keys[(period, _previous_period_start(period, start).isoformat())] = (period, 'previous')
+    placeholders = ", ".join("(?, ?)" for _ in keys)
+    params = [guild_id, user_id] + [value for key in keys for value in key]
+    with get_db_connection(guild_id) as conn:
+        rows = conn.execute(
+            f"SELECT period, period_start, seconds FROM duty_rollups WHERE guild_id = ? AND user_id = ? "
+            f"AND (period, period_start) IN (VALUES {placeholders})",
+            params
+        ).fetchall()
+    report = {label: 0 for label in keys.values()}
+    for row in rows:
+        report[keys[(row['period'], row['period_start'])]] = row['seconds']
+    return report
+
 # --- Funkcje logów zdarzeń ---
 
+# Wpisy duty_logs są buforowane w pamięci i zapisywane partiami w jednej transakcji:
+# po zebraniu AUDIT_BATCH_SIZE wpisów albo po AUDIT_FLUSH_INTERVAL_MS od pierwszego
+# niezapisanego wpisu. Gdy bufor jest pełny, nowe wpisy są odrzucane i liczone.
+AUDIT_BATCH_SIZE = 50
+AUDIT_FLUSH_INTERVAL_MS = 500
+AUDIT_MAX_PENDING = 10000
+
+class AuditLogWriter:
+    """Bufor zapisu wpisów duty_logs (write-behind)."""
+
+    def __init__(self, batch_size=AUDIT_BATCH_SIZE, flush_interval_ms=AUDIT_FLUSH_INTERVAL_MS, max_pending=AUDIT_MAX_PENDING):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._pending = []
+        self._timer = None
+        self._closed = False
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def append(self, guild_id, user_id, action, details=None):
+        """Dodaje wpis do bufora. Zwraca False, jeśli wpis został odrzucony."""
+        now = datetime.datetime.utcnow()
+        row = (now.isoformat(), _epoch(now), guild_id, user_id, action, details)
+        with self._lock:
+            if self._closed or len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                logger.warning(f"Odrzucono wpis logu służby (serwer {guild_id}, akcja: {action}) - bufor pełny lub zamknięty.")
+                return False
+            self._pending.append(row)
+            full = len(self._pending) >= self.batch_size
+            if not full and self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self._submit_flush)
+                self._timer.daemon = True
+                self._timer.start()
+        # Poza blokadą - _flush_pending sam ją bierze (Lock nie jest wielowejściowy)
+        if full:
+            self._submit_flush()
+        return True
+
+    def _submit_flush(self):
+        self._flush_pending()
+
+    def _flush_pending(self):
+        """Zleca zapis zbuforowanych wpisów wątkom zapisującym. Zwraca listę Future."""
+        with self._lock:
+            batch, self._pending = self._pending, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        # Jedna transakcja na plik bazy: bez shardów cała partia, z shardami - per serwer
+        groups = {}
+        for row in batch:
+            key = row[2] if SHARD_DIR is not None else None
+            groups.setdefault(key, []).append(row)
+        futures = []
+        for guild_id, rows in groups.items():
+            future = _submit_to_writer(_writer_index(guild_id), self._write_rows, guild_id, rows)
+            if future is not None:
+                futures.append(future)
+        return futures
+
+    def _write_rows(self, guild_id, rows):
+        try:
+            with get_db_connection(guild_id) as conn:
+                conn.executemany(_INSERT_DUTY_LOG, rows)
+        except sqlite3.Error:
+            with self._lock:
+                self.failed += len(rows)
+            logger.exception(f"Nie udało się zapisać {len(rows)} wpisów logu służby.")
+            return
+        with self._lock:
+            self.written += len(rows)
+
+    def flush(self):
+        """Zapisuje wszystkie zbuforowane wpisy i czeka na zakończenie zapisu."""
+        for future in self._flush_pending():
+            future.result()
+
+    def close(self):
+        """Zapisuje pozostałe wpisy i przestaje przyjmować nowe."""
+        with self._lock:
+            self._closed = True
+        return self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed,
+            }
+
+audit_log = AuditLogWriter()
+atexit.register(audit_log.close)
+
+@_memory_api
 def log_duty_event(guild_id, user_id, action, details=None):
-    with get_db_connection() as conn:
+    audit_log.append(guild_id, user_id, action, details)
+
+@_read_api
+def flush_duty_logs():
+    """Wymusza zapis zbuforowanych wpisów logu służby."""
+    audit_log.flush()
+
+@_read_api
+def get_duty_logs(guild_id, limit=100):
+    audit_log.flush()
+    with get_db_connection(guild_id) as conn:
+        return conn.execute("SELECT * FROM duty_logs WHERE guild_id = ? ORDER BY ts_epoch DESC, log_id DESC LIMIT ?", (guild_id, limit)).fetchall()
+
+@_read_api
+def get_duty_logs_page(guild_id, limit=10, before=None, after=None, user_id=None, action=None, since=None, until=None):
+    """
+    Zwraca stronę logów (od najnowszych) oraz informację, czy za nią są kolejne wpisy.
+    Stronicowanie jest kursorowe: `before`/`after` to para (ts_epoch, log_id) pierwszego
+    lub ostatniego wpisu poprzedniej strony, więc koszt nie rośnie z numerem strony.
+    `since`/`until` (datetime UTC) zawężają zakres czasu, `action` filtruje po fragmencie nazwy akcji.
+    """
+    audit_log.flush()
+    conditions = ["guild_id = ?"]
+    params = [guild_id]
+    if user_id is not None:
+        conditions.append("user_id = ?")
+        params.append(user_id)
+    if action:
+        conditions.append("action LIKE ?")
+        params.append(f"%{action}%")
+    if since is not None:
+        conditions.append("ts_epoch >= ?")
+        params.append(_epoch(since))
+    if until is not None:
+        conditions.append("ts_epoch < ?")
+        params.append(_epoch(until))
+    if after is not None:
+        # Poprzednia (nowsza) strona: czytamy rosnąco od kursora i odwracamy wynik
+        conditions.append("(ts_epoch, log_id) > (?, ?)")
+        params.extend(after)
+        order = "ASC"
+    else:
+        if before is not None:
+            conditions.append("(ts_epoch, log_id) < (?, ?)")
+            params.extend(before)
+        order = "DESC"
+    query = (f"SELECT * FROM duty_logs WHERE {' AND '.join(conditions)} "
+             f"ORDER BY ts_epoch {order}, log_id {order} LIMIT ?")
+    params.append(limit + 1)
+    with get_db_connection(guild_id) as conn:
+        rows = conn.execute(query, params).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if after is not None:
+        rows.reverse()
+    return rows, has_more
+
+# --- Zgłoszenia (tickety) ---
+#
+# Stan zgłoszenia jest kluczowany ID kanału, więc przejęcie i zamknięcie to odczyt
+# jednego wiersza - bez przeglądania historii kanału i bez stanu w pamięci widoku.
+
+@_write_api
+def create_ticket(guild_id, channel_id, creator_id, ticket_type):
+    with get_db_connection(guild_id) as conn:
         conn.execute(
-            "INSERT INTO duty_logs (timestamp, guild_id, user_id, action, details) VALUES (?, ?, ?, ?, ?)",
-            (datetime.datetime.utcnow().isoformat(), guild_id, user_id, action, details)
+            "INSERT INTO tickets (channel_id, guild_id, creator_id, ticket_type, created_at) VALUES (?, ?, ?, ?, ?)",
+            (channel_id, guild_id, creator_id, ticket_type, _epoch(datetime.datetime.utcnow()))
         )
 
-def get_duty_logs(guild_id, limit=100):
-    with get_db_connection() as conn:
-        return conn.execute("SELECT * FROM duty_logs WHERE guild_id = ? ORDER BY timestamp DESC LIMIT ?", (guild_id, limit)).fetchall()
\ No newline at end of file
+@_read_api
+def get_ticket(guild_id, channel_id):
+    with get_db_connection(guild_id) as conn:
+        return conn.execute("SELECT * FROM tickets WHERE channel_id = ?", (channel_id,)).fetchone()
+
+@_read_api
+def count_open_tickets(guild_id, creator_id):
+    with get_db_connection(guild_id) as conn:
+        return conn.execute(
+            "SELECT COUNT(*) FROM tickets WHERE guild_id = ? AND creator_id = ? AND closed_at IS NULL",
+            (guild_id, creator_id)
+        ).fetchone()[0]
+
+@_write_api
+def claim_ticket(guild_id, channel_id, user_id):
+    """Przejmuje zgłoszenie, jeśli nikt go jeszcze nie przejął. Zwraca aktualny wiersz zgłoszenia (albo None)."""
+    with get_db_connection(guild_id) as conn:
+        conn.execute(
+            "UPDATE tickets SET claimed_by = ?, claimed_at = ? WHERE channel_id = ? AND claimed_by IS NULL AND closed_at IS NULL",
+            (user_id, _epoch(datetime.datetime.utcnow()), channel_id)
+        )
+        return conn.execute("SELECT * FROM tickets WHERE channel_id = ?", (channel_id,)).fetchone()
+
+@_write_api
+def close_ticket(guild_id, channel_id):
+    """Oznacza zgłoszenie jako zamknięte. Zwraca False, jeśli było już zamknięte lub nie istnieje."""
+    with get_db_connection(guild_id) as conn:
+        return conn.execute(
+            "UPDATE tickets SET closed_at = ? WHERE channel_id = ? AND closed_at IS NULL",
+            (_epoch(datetime.datetime.utcnow()), channel_id)
+        ).rowcount == 1
+
+@_write_api
+def set_ticket_panel(guild_id, channel_id, message_id):
+    with get_db_connection(guild_id) as conn:
+        conn.execute(
+            "INSERT INTO ticket_panels (guild_id, channel_id, message_id) VALUES (?, ?, ?) "
+            "ON CONFLICT(guild_id) DO UPDATE SET channel_id = excluded.channel_id, message_id = excluded.message_id",
+            (guild_id, channel_id, message_id)
+        )
+
+@_read_api
+def get_ticket_panel(guild_id):
+    with get_db_connection(guild_id) as conn:
+        return conn.execute("SELECT * FROM ticket_panels WHERE guild_id = ?", (guild_id,)).fetchone()
+
+# --- Eksport danych ---
+
+EXPORT_BATCH_SIZE = 500
+EXPORT_TABLES = {
+    'duty_logs': (('log_id', 'timestamp', 'user_id', 'action', 'details'),
+                  "WHERE guild_id = ? ORDER BY ts_epoch, log_id"),
+    'user_duty_stats': (('user_id', 'total_duty_seconds'),
+                        "WHERE guild_id = ? ORDER BY total_duty_seconds DESC"),
+}
+
+def iter_guild_rows(table, guild_id, batch_size=EXPORT_BATCH_SIZE):
+    """Generator wierszy tabeli dla serwera, pobieranych partiami (bez fetchall)."""
+    if table == 'duty_logs':
+        audit_log.flush()
+    columns, condition = EXPORT_TABLES[table]
+    cursor = get_db_connection(guild_id).execute(f"SELECT {', '.join(columns)} FROM {table} {condition}", (guild_id,))
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cursor.close()
+
+@_read_api
+def export_guild_table(table, guild_id, path, fmt='csv'):
+    """
+    Zapisuje tabelę serwera do pliku `path` jako CSV lub JSONL skompresowany gzipem.
+    Wiersze są kodowane strumieniowo, więc zużycie pamięci nie zależy od rozmiaru tabeli.
+    Zwraca liczbę zapisanych wierszy.
+    """
+    count = 0
+    with gzip.open(path, 'wt', encoding='utf-8', newline='') as out:
+        if fmt == 'jsonl':
+            for row in iter_guild_rows(table, guild_id):
+                out.write(json.dumps(dict(row), ensure_ascii=False))
+                out.write('\n')
+                count += 1
+        else:
+            writer = csv.writer(out)
+            writer.writerow(EXPORT_TABLES[table][0])
+            for row in iter_guild_rows(table, guild_id):
+                writer.writerow(tuple(row))
+                count += 1
+    return count
+
+# --- Podział bazy na shardy ---
+
+# Tabele z kolumną guild_id, które przy shardach trafiają do pliku danego serwera
+SHARDED_TABLES = ('duty_panels', 'active_duty_users', 'user_duty_stats', 'duty_logs', 'duty_sessions', 'duty_rollups', 'user_names', 'tickets', 'ticket_panels')
+
+def split_into_shards(source_path, shard_dir):
+    """
+    Rozdziela monolityczną bazę `source_path` na pliki per serwer w `shard_dir`.
+    Źródło nie jest modyfikowane (poza ewentualnymi zaległymi migracjami).
+    Zwraca słownik {guild_id: liczba skopiowanych wierszy}.
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    source = _open_connection(source_path)
+    try:
+        apply_migrations(source)
+        guild_ids = set()
+        for table in SHARDED_TABLES:
+            guild_ids.update(row[0] for row in source.execute(f"SELECT DISTINCT guild_id FROM {table}"))
+    finally:
+        source.close()
+
+    copied = {}
+    for guild_id in sorted(guild_ids):
+        path = os.path.join(shard_dir, f"guild_{guild_id}.db")
+        shard = _open_connection(path)
+        try:
+            apply_migrations(shard)
+            shard.execute("ATTACH DATABASE ? AS source", (source_path,))
+            count = 0
+            with shard:
+                for table in SHARDED_TABLES:
+                    shard.execute(f"DELETE FROM main.{table} WHERE guild_id = ?", (guild_id,))
+                    count += shard.execute(f"INSERT INTO main.{table} SELECT * FROM source.{table} WHERE guild_id = ?", (guild_id,)).rowcount
+            shard.execute("DETACH DATABASE source")
+            copied[guild_id] = count
+        finally:
+            shard.close()
+    return copied
@@ -7,7 +7,7 @@ import sys
 import time
 import random
 import logging
-from database import initialize_db
+from database import initialize_db, configure as configure_db, shutdown as shutdown_db
 
 # Configure logging
 logging.basicConfig(
@@ -27,14 +27,20 @@ TOKEN = os.getenv("TOKEN")
 intents = discord.Intents.default()
 intents.message_content = True
 intents.guilds = True
-intents.members = True
+# Nazwy do paneli i logów są zapisywane w bazie przy interakcjach, więc uprzywilejowana intencja
+# członków nie jest potrzebna. Włącz ją (MEMBERS_INTENT=1 i zgoda w panelu deweloperskim) tylko,
+# jeśli /godziny_zbiorczo ma obsługiwać wskazanie roli - lista jej członków wymaga tej intencji.
+intents.members = os.getenv("MEMBERS_INTENT") == "1"
 
 class SupremeCourtBot(commands.Bot):
     def __init__(self):
         super().__init__(
             command_prefix="!",
             intents=intents,
-            help_command=None
+            help_command=None,
+            # Nie pobieramy i nie trzymamy wszystkich członków - nazwy do paneli są zapisywane w bazie
+            chunk_guilds_at_startup=False,
+            member_cache_flags=discord.MemberCacheFlags.none()
         )
         self.connection_attempts = 0
         self.max_reconnect_delay = 900  # 15 minutes in seconds
@@ -83,7 +89,8 @@ class SupremeCourtBot(commands.Bot):
                 logger.warning(f"Rate limit hit, details: {error.response}")
 
 if __name__ == "__main__":
-    # Inicjalizacja bazy danych przy starcie
+    # Inicjalizacja bazy danych przy starcie (opcjonalnie z podziałem na pliki per serwer)
+    configure_db(shard_dir=os.getenv("DB_SHARD_DIR") or None)
     initialize_db()
 
     bot = SupremeCourtBot()
@@ -115,4 +122,7 @@ if __name__ == "__main__":
             logger.error(f"Unexpected error: {e}")
             if attempt >= 5:  # After 5 attempts, give up
                 logger.critical("Too many failed attempts. Giving up.")
-                retry = False
\ No newline at end of file
+                retry = False
+
+    # Dokończ zaległe zapisy do bazy danych przed wyjściem
+    shutdown_db()
\ No newline at end of file
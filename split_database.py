@@ -0,0 +1,22 @@
+'''
+Narzędzie do podziału bazy database.db na osobne pliki per serwer (shardy).
+
+Użycie: python split_database.py <katalog_shardów> [ścieżka_bazy]
+Po podziale ustaw DB_SHARD_DIR=<katalog_shardów> w pliku .env.
+'''
+import sys
+import database
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    shard_dir = sys.argv[1]
+    source_path = sys.argv[2] if len(sys.argv) > 2 else database.DB_PATH
+    copied = database.split_into_shards(source_path, shard_dir)
+    for guild_id, count in copied.items():
+        print(f"Serwer {guild_id}: skopiowano {count} wierszy")
+    print(f"Utworzono {len(copied)} shardów w {shard_dir}.")
+
+if __name__ == "__main__":
+    main()
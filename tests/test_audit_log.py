@@ -0,0 +1,43 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import database
+
+
+class AuditLogBatchFlushTest(unittest.TestCase):
+    """Regresja: zapis partii po przekroczeniu batch_size nie może zakleszczyć append()."""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix="bot-db-test-")
+        database.configure(db_path=os.path.join(self.workdir, "database.db"))
+        with contextlib.redirect_stdout(io.StringIO()):
+            database.initialize_db()
+        # Osobny bufor - zakleszczenie nie zablokuje globalnego audit_log (ani atexit)
+        self.writer = database.AuditLogWriter(batch_size=10, flush_interval_ms=60000)
+
+    def tearDown(self):
+        database.close_connections()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def test_more_events_than_batch_size_in_a_row(self):
+        count = self.writer.batch_size * 3 + 7
+        worker = threading.Thread(
+            target=lambda: [self.writer.append(1, 1, "Test", str(i)) for i in range(count)],
+            daemon=True
+        )
+        worker.start()
+        worker.join(timeout=10)
+        self.assertFalse(worker.is_alive(), "append() zakleszczył się przy zapisie partii")
+
+        self.writer.flush()
+        self.assertEqual(self.writer.stats()["written"], count)
+        self.assertEqual(len(database.get_duty_logs(1, count + 1)), count)
+
+
+if __name__ == "__main__":
+    unittest.main()